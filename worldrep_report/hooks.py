@@ -122,6 +122,14 @@ app_license = "mit"
 # ---------------
 # Hook on document methods and events
 
+doc_events = {
+	"Account": {
+		"on_update": "worldrep_report.utils.clear_account_snapshot",
+		"after_rename": "worldrep_report.utils.clear_account_snapshot",
+		"on_trash": "worldrep_report.utils.clear_account_snapshot",
+	},
+}
+
 # doc_events = {
 #	"*": {
 #		"on_update": "method",
@@ -133,6 +141,18 @@ app_license = "mit"
 # Scheduled Tasks
 # ---------------
 
+scheduler_events = {
+	"cron": {
+		# after the nightly GL posting
+		"30 5 * * *": [
+			"worldrep_report.tasks.warm_up_report_cache",
+		],
+	},
+	"monthly_long": [
+		"worldrep_report.tasks.precompute_month_end_pack",
+	],
+}
+
 # scheduler_events = {
 #	"all": [
 #		"worldrep_report.tasks.all"
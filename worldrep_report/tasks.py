@@ -0,0 +1,90 @@
+import time
+
+import frappe
+from frappe.utils import flt, now
+
+from worldrep_report.worldrep_report.report.p_and_l.p_and_l import execute, execute_batch
+
+MONTH_END_PACK_CACHE_KEY = "worldrep_report|p_and_l|month_end_pack"
+WARM_UP_TIMINGS_CACHE_KEY = "worldrep_report|p_and_l|warm_up_timings"
+
+# Number of warm-up timings kept in the cache
+WARM_UP_TIMINGS_LIMIT = 1000
+
+
+def precompute_month_end_pack():
+    """
+    Compute the P and L for every filter set listed in the `p_and_l_month_end_pack` site config
+    in one batch, and keep the results in the cache until the next run.
+    """
+    filters_list = frappe.conf.get("p_and_l_month_end_pack")
+    if not filters_list:
+        return
+
+    frappe.cache().set_value(
+        MONTH_END_PACK_CACHE_KEY,
+        {"generated_on": now(), "results": execute_batch(filters_list)},
+    )
+
+
+@frappe.whitelist()
+def get_month_end_pack():
+    """Return the last precomputed month-end pack, if any, limited to the caller's companies."""
+    if not frappe.get_cached_doc("Report", "P and L").is_permitted():
+        frappe.throw(frappe._("You are not permitted to view this report."), frappe.PermissionError)
+
+    pack = frappe.cache().get_value(MONTH_END_PACK_CACHE_KEY)
+    if not pack:
+        return pack
+
+    return dict(
+        pack,
+        results=[
+            result
+            for result in pack["results"]
+            if frappe.has_permission("Company", doc=result["filters"].get("company"))
+        ],
+    )
+
+
+def warm_up_report_cache():
+    """
+    Run the P and L for every filter set listed in the `p_and_l_warm_up_filters` site config,
+    so that the account snapshots and GL scans of the dashboard views are cached before the
+    first users open them. Each run is timed and logged.
+    """
+    filters_list = frappe.conf.get("p_and_l_warm_up_filters")
+    if not filters_list:
+        return
+
+    logger = frappe.logger("worldrep_report.warm_up", allow_site=True)
+
+    for filters in filters_list:
+        start = time.monotonic()
+        try:
+            execute(frappe._dict(filters))
+        except Exception:
+            frappe.log_error(title=frappe._("P and L warm-up failed"))
+            continue
+
+        timing = {
+            "timestamp": now(),
+            "company": filters.get("company"),
+            "filters": filters,
+            "seconds": flt(time.monotonic() - start, 3),
+        }
+        logger.info(timing)
+        frappe.cache().lpush(WARM_UP_TIMINGS_CACHE_KEY, frappe.as_json(timing))
+
+    frappe.cache().ltrim(WARM_UP_TIMINGS_CACHE_KEY, 0, WARM_UP_TIMINGS_LIMIT - 1)
+
+
+@frappe.whitelist()
+def get_warm_up_timings():
+    """Return the recorded warm-up timings, latest first."""
+    frappe.only_for("System Manager")
+
+    return [
+        frappe.parse_json(frappe.safe_decode(timing))
+        for timing in frappe.cache().lrange(WARM_UP_TIMINGS_CACHE_KEY, 0, -1)
+    ]
@@ -1,20 +1,29 @@
 import frappe
+from frappe.query_builder.functions import Sum
 from frappe.utils import flt
-from erpnext.accounts.utils import get_fiscal_year
+from erpnext.accounts.utils import FiscalYearError, get_fiscal_year
 import functools  # Importing functools module
+import hashlib
 import math
 import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import ROUND_HALF_UP, Decimal
 
 from frappe import _
 from frappe.utils import (
 	add_days,
 	add_months,
+	add_to_date,
 	cint,
 	cstr,
 	flt,
 	formatdate,
 	get_first_day,
+	get_last_day,
 	getdate,
+	now_datetime,
+	time_diff_in_seconds,
 	today,
 )
 
@@ -22,7 +31,321 @@ from erpnext.accounts.doctype.accounting_dimension.accounting_dimension import (
 	get_accounting_dimensions,
 	get_dimension_with_children,
 )
-from erpnext.accounts.report.utils import convert_to_presentation_currency, get_currency
+from erpnext.accounts.report.financial_statements import get_cost_centers_with_children, get_period_list
+from erpnext.accounts.report.utils import convert, convert_to_presentation_currency, get_currency
+
+# How long computed report data is kept in the cache, in seconds
+REPORT_CACHE_TTL = 60 * 60
+
+# GL scans are kept with the GL high-water mark they were taken at, until the next warm-up
+GL_CACHE_TTL = 24 * 60 * 60
+
+# A cached GL scan is brought up to date with at most this many deltas, for at most this many
+# seconds after the full scan; past either, it is scanned again
+GL_DELTA_MAX_COUNT = 20
+GL_DELTA_MAX_AGE = 60 * 60
+
+# GL rows modified in the last seconds may belong to transactions that have not committed yet, so
+# cached GL scans only advance up to this many seconds ago; newer rows are read for each run
+GL_COMMIT_WINDOW = 2 * 60
+
+ACCOUNT_SNAPSHOT_CACHE_KEY = "worldrep_report|p_and_l|accounts"
+
+# Account snapshots are checked against the chart version on read; the TTL bounds anything missed
+ACCOUNT_SNAPSHOT_CACHE_TTL = 24 * 60 * 60
+
+# Default for the `p_and_l_replica_max_lag` site config, in seconds
+REPLICA_MAX_LAG = 60
+
+# Filters that only change how the report is displayed, not its values
+DISPLAY_ONLY_FILTERS = ("selected_view", "progressive_loading", "lazy_tree_depth")
+
+
+@contextmanager
+def use_report_replica():
+    """
+    Run the report's read-only queries on the site's read replica when `p_and_l_read_from_replica`
+    is set, or when the request already switched to the replica (`read_from_replica`).
+
+    The replica is only used while it lags the primary by at most `p_and_l_replica_max_lag`
+    seconds; when it lags more, its lag is unknown or it cannot be reached, the queries fall
+    back to the primary.
+    """
+    local = frappe.local
+    switched_connection = False
+
+    if not hasattr(local, "primary_db"):
+        if not (frappe.conf.get("p_and_l_read_from_replica") and frappe.conf.get("replica_host")):
+            yield
+            return
+
+        switched_connection = frappe.connect_replica()
+
+    fell_back = False
+    if getattr(local, "replica_db", None) is not None and local.db is local.replica_db:
+        if not is_replica_fresh():
+            local.db = local.primary_db
+            fell_back = True
+
+    try:
+        yield
+    finally:
+        if fell_back:
+            local.db = local.replica_db
+
+        if switched_connection:
+            local.db.close()
+            local.db = local.primary_db
+            del local.replica_db
+            del local.primary_db
+
+
+def is_replica_fresh():
+    """
+    Whether the replica connection in `frappe.db` lags the primary by no more than the
+    configured bound.
+    """
+    max_lag = cint(frappe.conf.get("p_and_l_replica_max_lag") or REPLICA_MAX_LAG)
+
+    try:
+        lag = get_replica_lag()
+    except Exception:
+        frappe.logger("worldrep_report").warning("P and L: read replica unreachable, using primary", exc_info=True)
+        return False
+
+    if lag is None or lag > max_lag:
+        frappe.logger("worldrep_report").warning(f"P and L: read replica lag {lag}s over {max_lag}s, using primary")
+        return False
+
+    return True
+
+
+def get_replica_lag():
+    """Replication lag of the connected replica in seconds, or None if it is not replicating."""
+    if frappe.db.db_type == "postgres":
+        return frappe.db.sql("select extract(epoch from now() - pg_last_xact_replay_timestamp())")[0][0]
+
+    status = frappe.db.sql("show slave status", as_dict=True)
+    return status[0].get("Seconds_Behind_Master") if status else None
+
+
+def get_report_context(filters, shared=None):
+    """
+    Build the context for one report run: company, currencies, finance book, period list and
+    the compiled GL filter state. Created once per run and passed to every helper.
+
+    `shared` holds the account snapshots and GL scans reused across sections, and across runs
+    when several contexts are given the same dict (see `get_shared_cache`).
+    """
+    filters = frappe._dict(filters or {})
+    company_currency, default_finance_book = frappe.get_cached_value(
+        "Company", filters.company, ["default_currency", "default_finance_book"]
+    )
+
+    period_list = get_period_list(
+        filters.from_fiscal_year,
+        filters.to_fiscal_year,
+        filters.period_start_date,
+        filters.period_end_date,
+        filters.filter_based_on,
+        filters.periodicity,
+        company=filters.company,
+    )
+    filters.period_start_date = period_list[0]["year_start_date"]
+
+    compare_with = filters.get("compare_with")
+    comparative_period_list = (
+        get_comparative_period_list(period_list, compare_with, filters.company) if compare_with else []
+    )
+    gl_conditions = compile_gl_conditions(filters, default_finance_book)
+    currency_info = get_currency(filters) if filters.presentation_currency else None
+    precision = frappe.get_precision("GL Entry", "debit")
+    # zero-decimal currencies have a precision of 0
+    precision = 2 if precision is None else cint(precision)
+
+    return frappe._dict(
+        filters=filters,
+        company=filters.company,
+        company_currency=company_currency,
+        currency=filters.presentation_currency or company_currency,
+        currency_info=currency_info,
+        # amounts are accumulated as integers of 10 ** -precision and converted once on output
+        precision=precision,
+        scale=10**precision,
+        finance_book=filters.finance_book,
+        default_finance_book=default_finance_book,
+        period_list=period_list,
+        # fiscal year bounds as set on every account row
+        year_start_date=period_list[0]["year_start_date"].strftime("%Y-%m-%d"),
+        year_end_date=period_list[-1]["year_end_date"].strftime("%Y-%m-%d"),
+        tree_depth=cint(filters.get("lazy_tree_depth")),
+        cache_key=get_filters_hash(filters),
+        compare_with=compare_with,
+        comparative_period_list=comparative_period_list,
+        gl_conditions=gl_conditions,
+        # GL scans can only be shared between runs with the same GL filters and currency
+        gl_key=frappe.as_json([gl_conditions, currency_info]),
+        shared=shared if shared is not None else get_shared_cache(),
+    )
+
+
+def get_shared_cache():
+    """
+    Account snapshots, chart versions and labels by company and GL scans by scan key, shared
+    by the contexts it is given to.
+    """
+    return frappe._dict(accounts={}, account_versions={}, labels={}, gl_entries={}, gl_watermark=None)
+
+
+def to_minor_units(value, ctx):
+    """
+    Convert an amount to an integer number of minor units (e.g. cents) of the report precision.
+    """
+    if not isinstance(value, Decimal):
+        # through the shortest repr, so that 1.005 rounds like the 1.005 stored in the database
+        value = Decimal(str(flt(value)))
+
+    return int((value * ctx.scale).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_minor_units(value, ctx):
+    return flt(value / ctx.scale, ctx.precision)
+
+
+def sum_minor_units(rows, key, ctx, root_only=False):
+    """
+    Exact sum of `key` over report rows, in minor units. With `root_only`, only rows at
+    indent 0 are summed.
+    """
+    return sum(
+        to_minor_units(row.get(key, 0), ctx)
+        for row in rows or []
+        if not root_only or row.get("indent") == 0
+    )
+
+
+def get_filters_hash(filters):
+    """
+    Hash of the filters that affect the report values, used to key cached report data.
+    """
+    values = {key: value for key, value in filters.items() if key not in DISPLAY_ONLY_FILTERS}
+    return hashlib.sha1(frappe.as_json(values).encode()).hexdigest()
+
+
+def get_report_cache_key(ctx, *parts):
+    """
+    Cache key of report data for the filters of `ctx`. Report rows hold translated account
+    labels, so the key includes the language.
+    """
+    return "|".join(["worldrep_report", "p_and_l", ctx.cache_key, frappe.local.lang, *parts])
+
+
+def get_comparative_period_list(period_list, compare_with, company):
+    """
+    Build the periods compared against `period_list`: the same periods one year earlier for
+    "Previous Year", or the same periods for "Budget". Each comparative period points back to
+    its current period through `current_key` and carries the key of its variance column.
+
+    Periods that fall outside any fiscal year (the year before a company's first one) are
+    kept without a fiscal year, so their comparative values stay empty.
+    """
+    months = -12 if compare_with == "Previous Year" else 0
+    suffix = _("Prior Year") if compare_with == "Previous Year" else _("Budget")
+
+    comparative_period_list = []
+    for period in period_list:
+        to_date = add_months_to_period_end(period.to_date, months)
+        comparative_period_list.append(
+            frappe._dict(
+                period,
+                key=f"{period.key}_comparative",
+                current_key=period.key,
+                variance_key=f"{period.key}_variance",
+                label="{0} ({1})".format(formatdate(to_date, "MMM YYYY"), suffix),
+                variance_label=_("{0} Variance").format(period.label),
+                from_date=getdate(add_months(period.from_date, months)),
+                to_date=to_date,
+                year_start_date=getdate(add_months(period.year_start_date, months)),
+                year_end_date=add_months_to_period_end(period.year_end_date, months),
+                to_date_fiscal_year=get_fiscal_year_name(to_date, company),
+            )
+        )
+
+    return comparative_period_list
+
+
+def add_months_to_period_end(date, months):
+    """
+    `add_months` for period end dates: month ends stay month ends, so that 28 Feb 2025 maps to
+    29 Feb 2024 and no day falls between two comparative periods.
+    """
+    date = getdate(date)
+    shifted = getdate(add_months(date, months))
+    return get_last_day(shifted) if date == get_last_day(date) else shifted
+
+
+def get_fiscal_year_name(date, company):
+    """Name of the fiscal year of `date`, or None if no fiscal year covers it."""
+    try:
+        return get_fiscal_year(date, company=company, verbose=0)[0]
+    except FiscalYearError:
+        return None
+
+
+def get_value_periods(ctx):
+    """
+    Periods that carry values in the account rows: the report periods followed by the
+    comparative periods, if any.
+    """
+    return ctx.period_list + ctx.comparative_period_list
+
+
+def set_variance(row, ctx):
+    """
+    Set the variance (current - comparative) of every period present in `row`.
+    """
+    for period in ctx.comparative_period_list:
+        if period.current_key in row or period.key in row:
+            row[period.variance_key] = from_minor_units(
+                to_minor_units(row.get(period.current_key, 0), ctx) - to_minor_units(row.get(period.key, 0), ctx),
+                ctx,
+            )
+
+
+def compile_gl_conditions(filters, default_finance_book=None):
+    """
+    Resolve the GL filters (projects, cost centers with children, finance books and
+    accounting dimensions) once, so that every GL query of a run reuses them.
+    """
+    conditions = frappe._dict(dimensions={})
+
+    if filters.get("project"):
+        project = filters.get("project")
+        conditions.project = project if isinstance(project, list) else frappe.parse_json(project)
+
+    if filters.get("cost_center"):
+        conditions.cost_center = get_cost_centers_with_children(filters.cost_center)
+
+    conditions.finance_books = [cstr(filters.finance_book), ""]
+    if filters.get("include_default_book_entries"):
+        if (
+            filters.finance_book
+            and default_finance_book
+            and cstr(filters.finance_book) != cstr(default_finance_book)
+        ):
+            frappe.throw(_("To use a different finance book, please uncheck 'Include Default FB Entries'"))
+
+        conditions.finance_books.insert(1, cstr(default_finance_book))
+
+    for dimension in get_accounting_dimensions(as_list=False):
+        if filters.get(dimension.fieldname):
+            values = filters.get(dimension.fieldname)
+            if frappe.get_cached_value("DocType", dimension.document_type, "is_tree"):
+                values = get_dimension_with_children(dimension.document_type, values)
+
+            conditions.dimensions[dimension.fieldname] = values
+
+    return conditions
 
 
 def filter_accounts(accounts, depth=20):
@@ -73,12 +396,10 @@ def sort_accounts(accounts, is_root=False, key="name"):
 
 
 def get_data_with_account_type(
-    company,
+    ctx,
     root_type=None,
     account_type=None,
     balance_must_be=None,
-    period_list=None,
-    filters=None,
     accumulated_values=1,
     only_current_fiscal_year=True,
     ignore_closing_entries=False,
@@ -90,134 +411,454 @@ def get_data_with_account_type(
     Custom function to fetch data with filtering by both root_type and account_type.
     """
     # Pass the exclude_account_type to the function
-    accounts = get_accounts_with_account_type(company, root_type, account_type, exclude_account_type)
+    accounts = get_accounts_with_account_type(ctx, root_type, account_type, exclude_account_type)
     if not accounts:
         return None
 
     accounts, accounts_by_name, parent_children_map = filter_accounts(accounts)
-
-    company_currency = frappe.get_cached_value("Company", company, "default_currency")
-
-    gl_entries_by_account = {}
-    for root in frappe.db.sql(
-        """select lft, rgt from tabAccount
-            where root_type=%s and ifnull(parent_account, '') = ''""",
-        root_type,
-        as_dict=1,
-    ):
-
-        set_gl_entries_by_account(
-            company,
-            period_list[0]["year_start_date"] if only_current_fiscal_year else None,
-            period_list[-1]["to_date"],
-            root.lft,
-            root.rgt,
-            filters,
-            gl_entries_by_account,
-            ignore_closing_entries=ignore_closing_entries,
-            root_type=root_type,
-            account_type=account_type,
-        )
+    period_list = ctx.period_list
+    report_type = "Profit and Loss" if root_type in ("Income", "Expense") else "Balance Sheet"
+
+    # previous year comparison widens the same scan instead of running a second one
+    scan_start_date = period_list[0]["year_start_date"]
+    if ctx.compare_with == "Previous Year":
+        scan_start_date = ctx.comparative_period_list[0]["year_start_date"]
+
+    all_gl_entries_by_account = get_gl_entries_by_account(
+        ctx,
+        scan_start_date if only_current_fiscal_year else None,
+        period_list[-1]["to_date"],
+        report_type,
+        ignore_closing_entries=ignore_closing_entries,
+        opening_date=scan_start_date,
+    )
+    gl_entries_by_account = {
+        account: all_gl_entries_by_account[account]
+        for account in accounts_by_name
+        if account in all_gl_entries_by_account
+    }
 
     calculate_values(
         accounts_by_name,
         gl_entries_by_account,
-        period_list,
+        ctx,
         accumulated_values,
         ignore_accumulated_values_for_fy,
+        only_current_fiscal_year=only_current_fiscal_year,
     )
-    accumulate_values_into_parents(accounts, accounts_by_name, period_list)
-    out = prepare_data(accounts, balance_must_be, period_list, company_currency)
+    if ctx.compare_with == "Budget":
+        set_budget_values(accounts_by_name, ctx, accumulated_values)
+    accumulate_values_into_parents(accounts, accounts_by_name, ctx)
+    out = prepare_data(accounts, balance_must_be, ctx)
     out = filter_out_zero_value_rows(out, parent_children_map)
 
     if out and total:
-        add_total_row(out, root_type, balance_must_be, period_list, company_currency)
+        add_total_row(
+            out, root_type, balance_must_be, ctx, [account for account in accounts if not account.parent_account]
+        )
 
     return out
 
-def get_accounts_with_account_type(company, root_type=None, account_type=None, exclude_account_type=None):
+def get_account_snapshot(ctx):
     """
-    Fetch accounts based on company, root_type, account_type, and optionally exclude specific account types.
+    All accounts of the company ordered by lft, fetched once and shared through `ctx.shared`.
+    The snapshot is also kept in the site cache along with the chart version it was read at,
+    and is only reused while that version is current.
+    """
+    if ctx.company not in ctx.shared.accounts:
+        version = get_account_snapshot_version(ctx)
+        cached = frappe.cache().get_value(get_account_snapshot_cache_key(ctx.company))
+        if cached and cached["version"] == version:
+            accounts = cached["accounts"]
+        else:
+            accounts = frappe.db.sql(
+                """
+                select name, account_number, parent_account, lft, rgt, root_type, report_type, account_name, include_in_gross, account_type, is_group
+                from `tabAccount`
+                where company=%s
+                order by lft
+                """,
+                ctx.company,
+                as_dict=True,
+            )
+            frappe.cache().set_value(
+                get_account_snapshot_cache_key(ctx.company),
+                {"version": version, "accounts": accounts},
+                expires_in_sec=ACCOUNT_SNAPSHOT_CACHE_TTL,
+            )
+
+        ctx.shared.accounts[ctx.company] = accounts
+
+    return ctx.shared.accounts[ctx.company]
+
+
+def get_account_snapshot_version(ctx):
+    """
+    Version of the chart of accounts of the company: latest `modified` and account count.
+    Also covers changes that skip the Account hooks, such as `frappe.db.set_value`.
     """
-    conditions = []
-    params = [company]
+    if ctx.company not in ctx.shared.account_versions:
+        last_modified, count = frappe.db.sql(
+            "select max(modified), count(*) from `tabAccount` where company=%s", ctx.company
+        )[0]
+        ctx.shared.account_versions[ctx.company] = f"{cstr(last_modified)}|{cint(count)}"
+
+    return ctx.shared.account_versions[ctx.company]
+
 
-    if root_type:
-        conditions.append("root_type=%s")
-        params.append(root_type)
+def get_account_snapshot_cache_key(company):
+    return f"{ACCOUNT_SNAPSHOT_CACHE_KEY}|{company}"
 
-    if account_type:
-        conditions.append("account_type=%s")
-        params.append(account_type)
 
-    if exclude_account_type:
-        if isinstance(exclude_account_type, list):
-            placeholders = ', '.join(['%s'] * len(exclude_account_type))
-            conditions.append(f"account_type NOT IN ({placeholders})")
-            params.extend(exclude_account_type)
+def get_account_labels(ctx):
+    """
+    Translated account, parent account and display name of every account in the snapshot,
+    formatted once per company and language and cached under the snapshot's chart version.
+    """
+    lang = frappe.local.lang
+    if (ctx.company, lang) not in ctx.shared.labels:
+        version = get_account_snapshot_version(ctx)
+        cache_key = get_account_labels_cache_key(ctx.company, lang)
+        cached = frappe.cache().get_value(cache_key)
+        if cached and cached["version"] == version:
+            labels = cached["labels"]
         else:
-            conditions.append("account_type <> %s")
-            params.append(exclude_account_type)
+            labels = {account.name: get_account_label(account) for account in get_account_snapshot(ctx)}
+            frappe.cache().set_value(
+                cache_key,
+                {"version": version, "labels": labels},
+                expires_in_sec=ACCOUNT_SNAPSHOT_CACHE_TTL,
+            )
+
+        ctx.shared.labels[(ctx.company, lang)] = labels
+
+    return ctx.shared.labels[(ctx.company, lang)]
 
-    query = f"""
-        select name, account_number, parent_account, lft, rgt, root_type, report_type, account_name, include_in_gross, account_type, is_group, lft, rgt
-        from `tabAccount`
-        where company=%s {"and " + " and ".join(conditions) if conditions else ""}
-        order by lft
+
+def get_account_label(account):
+    return (
+        _(account.name),
+        _(account.parent_account) if account.parent_account else "",
+        (
+            "%s - %s" % (_(account.account_number), _(account.account_name))
+            if account.account_number
+            else _(account.account_name)
+        ),
+    )
+
+
+def get_account_labels_cache_key(company, lang):
+    return f"{ACCOUNT_SNAPSHOT_CACHE_KEY}|labels|{company}|{lang}"
+
+
+def clear_account_snapshot(doc, method=None, *args):
+    """
+    Drop the cached account snapshot of the company once the change is committed; hooked on
+    Account changes (`after_rename` also passes the old and new name and the merge flag).
     """
+    company = doc.company
 
-    return frappe.db.sql(query, tuple(params), as_dict=True)
+    # labels are keyed on the chart version and need no clearing
+    frappe.db.after_commit.add(lambda: frappe.cache().delete_value(get_account_snapshot_cache_key(company)))
 
-def set_gl_entries_by_account(
-    company,
+
+def get_gl_watermark(ctx):
+    """
+    Latest `modified` of GL Entry, read once per shared cache. Posting or cancelling GL
+    entries moves it; GL scans cached under an older mark are brought up to date from the
+    rows changed since (see `get_gl_entries_by_account`).
+    """
+    if ctx.shared.gl_watermark is None:
+        ctx.shared.gl_watermark = cstr(frappe.db.sql("select max(modified) from `tabGL Entry`")[0][0])
+
+    return ctx.shared.gl_watermark
+
+
+def get_gl_settled_mark(ctx):
+    """
+    The GL watermark, held back to `GL_COMMIT_WINDOW` seconds ago. Every GL row modified up
+    to this mark has been committed, so a scan taken at it stays complete.
+    """
+    watermark = get_gl_watermark(ctx)
+    if not watermark:
+        return watermark
+
+    return min(watermark, cstr(add_to_date(now_datetime(), seconds=-GL_COMMIT_WINDOW)))
+
+
+def get_accounts_with_account_type(ctx, root_type=None, account_type=None, exclude_account_type=None):
+    """
+    Fetch accounts based on company, root_type, account_type, and optionally exclude specific account types.
+    """
+    if exclude_account_type and not isinstance(exclude_account_type, list):
+        exclude_account_type = [exclude_account_type]
+
+    # copies, since the report values are set on the account rows
+    return [
+        frappe._dict(account)
+        for account in get_account_snapshot(ctx)
+        if (not root_type or account.root_type == root_type)
+        and (not account_type or account.account_type == account_type)
+        and (not exclude_account_type or account.account_type not in exclude_account_type)
+    ]
+
+
+def get_gl_entries_by_account(
+    ctx,
     from_date,
     to_date,
-    root_lft,
-    root_rgt,
-    filters,
-    gl_entries_by_account,
+    report_type,
     ignore_closing_entries=False,
-    ignore_opening_entries=False,
-    root_type=None,
-    account_type=None,
+    opening_date=None,
 ):
     """
-    Modified function to filter GL entries by root_type and account_type.
+    GL entries of every ledger account of `report_type`, grouped by account. The scan is run
+    once and shared by all sections, and by every context sharing `ctx.shared`.
+
+    The scan is also kept in the site cache together with the GL watermark it was taken at.
+    When GL entries are posted or cancelled later, only the rows changed since that mark are
+    fetched and appended as delta rows, instead of scanning the whole period again. Deltas
+    are capped in number and age (see `can_apply_gl_delta`), falling back to a full scan.
+
+    Scans with a start date are cached up to the settled mark (see `get_gl_settled_mark`)
+    only, so that rows committed late are picked up by the next delta; the rows changed
+    since that mark are added for the current run without being cached.
+
+    Cached entries stay in company currency. With a presentation currency, the entries of the
+    run are converted as one batch, as a fresh scan would be.
     """
-    gl_entries = []
+    scan_key = (ctx.company, report_type, from_date, to_date, opening_date, ignore_closing_entries, ctx.gl_key)
+
+    if scan_key not in ctx.shared.gl_entries:
+        cache_key = "|".join(
+            [
+                "worldrep_report",
+                "p_and_l",
+                "gl",
+                hashlib.sha1(frappe.as_json(scan_key).encode()).hexdigest(),
+            ]
+        )
+        watermark = get_gl_watermark(ctx)
+        mark = get_gl_settled_mark(ctx) if from_date else watermark
+        accounts_list = [
+            account.name
+            for account in get_account_snapshot(ctx)
+            if not account.is_group and account.report_type == report_type
+        ]
+
+        cached = frappe.cache().get_value(cache_key)
+        gl_entries_by_account = None
+        if cached and cached["watermark"] == mark:
+            gl_entries_by_account = cached["entries"]
+        elif can_apply_gl_delta(ctx, cached, from_date):
+            gl_entries_by_account = add_gl_entries(
+                cached["entries"],
+                get_gl_delta_entries(
+                    ctx, from_date, to_date, accounts_list, ignore_closing_entries, cached["watermark"], mark
+                ),
+            )
+            frappe.cache().set_value(
+                cache_key,
+                dict(cached, watermark=mark, deltas=cached["deltas"] + 1, entries=gl_entries_by_account),
+                # the entry expires as if it were never refreshed
+                expires_in_sec=max(GL_CACHE_TTL - cint(time_diff_in_seconds(now_datetime(), cached["scanned_at"])), 1),
+            )
 
-    account_filters = {
-        "company": company,
-        "is_group": 0,
-        "lft": (">=", root_lft),
-        "rgt": ("<=", root_rgt),
-    }
+        if gl_entries_by_account is None:
+            gl_entries_by_account = set_gl_entries_by_account(
+                ctx,
+                from_date,
+                to_date,
+                accounts_list,
+                {},
+                ignore_closing_entries=ignore_closing_entries,
+                opening_date=opening_date,
+                as_of=mark,
+                convert_currency=False,
+            )
+            frappe.cache().set_value(
+                cache_key,
+                {
+                    "watermark": mark,
+                    "scanned_at": now_datetime(),
+                    "deltas": 0,
+                    "entries": gl_entries_by_account,
+                },
+                expires_in_sec=GL_CACHE_TTL,
+            )
+
+        if mark != watermark:
+            gl_entries_by_account = add_gl_entries(
+                {account: list(entries) for account, entries in gl_entries_by_account.items()},
+                get_gl_delta_entries(
+                    ctx, from_date, to_date, accounts_list, ignore_closing_entries, mark, watermark
+                ),
+            )
+
+        if ctx.currency_info:
+            gl_entries_by_account = convert_gl_entries_to_presentation_currency(gl_entries_by_account, ctx)
+
+        ctx.shared.gl_entries[scan_key] = gl_entries_by_account
+
+    return ctx.shared.gl_entries[scan_key]
 
-    if root_type:
-        account_filters.update({"root_type": root_type})
 
-    if account_type:
-        account_filters.update({"account_type": account_type})
+def add_gl_entries(gl_entries_by_account, entries):
+    for entry in entries:
+        gl_entries_by_account.setdefault(entry.account, []).append(entry)
 
-    accounts_list = frappe.db.get_all(
-        "Account",
-        filters=account_filters,
-        pluck="name",
+    return gl_entries_by_account
+
+
+def convert_gl_entries_to_presentation_currency(gl_entries_by_account, ctx):
+    """
+    Copies of the entries, converted in one batch. ERPNext uses the amounts in account
+    currency when every entry of the batch is in the presentation currency, so a delta must
+    not be converted on its own.
+    """
+    entries = [frappe._dict(entry) for entries in gl_entries_by_account.values() for entry in entries]
+    convert_to_presentation_currency(entries, ctx.currency_info)
+
+    return add_gl_entries({}, entries)
+
+
+def can_apply_gl_delta(ctx, cached, from_date):
+    """
+    Whether the cached GL scan `cached` may be brought up to date with a delta instead of a
+    full scan: it has a start date, is recent enough, has not had too many deltas yet and the
+    ledger was not rebuilt since.
+    """
+    return bool(
+        cached
+        and cached["watermark"]
+        and cached.get("scanned_at")
+        and from_date
+        and cached["deltas"] < GL_DELTA_MAX_COUNT
+        and time_diff_in_seconds(now_datetime(), cached["scanned_at"]) < GL_DELTA_MAX_AGE
+        and not has_ledger_rebuild_since(ctx, cached["watermark"])
     )
 
+
+def has_ledger_rebuild_since(ctx, watermark):
+    """
+    Whether the ledger of the company may have changed since `watermark` in ways the GL delta
+    does not show: closing and reposting rewrite Account Closing Balance and GL rows in place,
+    and with `delete_linked_ledger_entries` deleting a voucher deletes its GL rows.
+    """
+    if any(
+        frappe.db.exists(doctype, {"company": ctx.company, "modified": (">", watermark)})
+        for doctype in ("Period Closing Voucher", "Repost Item Valuation", "Repost Accounting Ledger")
+    ):
+        return True
+
+    return bool(
+        frappe.db.get_single_value("Accounts Settings", "delete_linked_ledger_entries")
+        and frappe.db.exists("Deleted Document", {"creation": (">", watermark)})
+    )
+
+
+def get_gl_delta_entries(ctx, from_date, to_date, accounts_list, ignore_closing_entries, since, until):
+    """
+    GL rows changed between the `since` and `until` watermarks, aggregated like a full scan:
+    rows posted in between count as they are, rows cancelled in between are negated. Amounts
+    are left in company currency.
+    """
+    entries = []
+
     if accounts_list:
-        gl_entries += get_accounting_entries(
+        entries += get_accounting_entries(
             "GL Entry",
             from_date,
             to_date,
             accounts_list,
-            filters,
+            ctx,
             ignore_closing_entries,
-            ignore_opening_entries=ignore_opening_entries,
+            group_by_posting_date=True,
+            as_of=until,
+            changed_since=since,
+        )
+
+        cancelled_entries = get_accounting_entries(
+            "GL Entry",
+            from_date,
+            to_date,
+            accounts_list,
+            ctx,
+            ignore_closing_entries,
+            group_by_posting_date=True,
+            as_of=until,
+            changed_since=since,
+            cancelled=True,
         )
+        for entry in cancelled_entries:
+            for field in ("debit", "credit", "debit_in_account_currency", "credit_in_account_currency"):
+                entry[field] = -(entry[field] or 0)
+        entries += cancelled_entries
+
+    return entries
 
-        if filters and filters.get("presentation_currency"):
-            convert_to_presentation_currency(gl_entries, get_currency(filters))
+
+def set_gl_entries_by_account(
+    ctx,
+    from_date,
+    to_date,
+    accounts_list,
+    gl_entries_by_account,
+    ignore_closing_entries=False,
+    ignore_opening_entries=False,
+    opening_date=None,
+    as_of=None,
+    convert_currency=True,
+):
+    """
+    Fetch the GL entries of `accounts_list` into `gl_entries_by_account`.
+
+    When `from_date` is not set and `opening_date` is, balances before `opening_date` are
+    fetched as one aggregated row per account (see `get_opening_entries`) instead of
+    scanning every historical GL row. With `as_of`, the ledger is read as it was at that
+    GL watermark. With `convert_currency` unset, amounts are left in company currency.
+    """
+    gl_entries = []
+
+    if accounts_list:
+        if not from_date and opening_date:
+            gl_entries += get_opening_entries(
+                ctx,
+                opening_date,
+                accounts_list,
+                ignore_closing_entries,
+                ignore_opening_entries=ignore_opening_entries,
+                as_of=as_of,
+            )
+            from_date = opening_date
+
+        shard_count = cint(frappe.conf.get("p_and_l_gl_shards"))
+        if from_date and shard_count > 1:
+            gl_entries += get_sharded_accounting_entries(
+                ctx,
+                from_date,
+                to_date,
+                accounts_list,
+                ignore_closing_entries,
+                shard_count,
+                ignore_opening_entries=ignore_opening_entries,
+                as_of=as_of,
+            )
+        else:
+            gl_entries += get_accounting_entries(
+                "GL Entry",
+                from_date,
+                to_date,
+                accounts_list,
+                ctx,
+                ignore_closing_entries,
+                ignore_opening_entries=ignore_opening_entries,
+                group_by_posting_date=True,
+                as_of=as_of,
+            )
+
+        if convert_currency and ctx.currency_info:
+            convert_to_presentation_currency(gl_entries, ctx.currency_info)
 
         for entry in gl_entries:
             gl_entries_by_account.setdefault(entry.account, []).append(entry)
@@ -225,23 +866,214 @@ def set_gl_entries_by_account(
     return gl_entries_by_account
 
 
+def get_sharded_accounting_entries(
+    ctx,
+    from_date,
+    to_date,
+    accounts,
+    ignore_closing_entries,
+    shard_count,
+    ignore_opening_entries=False,
+    as_of=None,
+):
+    """
+    Aggregate the GL entries of `from_date`..`to_date` in up to `shard_count` date shards, each
+    on its own database connection in a separate thread. Shards follow the report period
+    boundaries and do not overlap, so their rows are simply concatenated.
+    """
+    shards = get_gl_shards(ctx, from_date, to_date, shard_count)
+    if len(shards) == 1:
+        return get_accounting_entries(
+            "GL Entry",
+            from_date,
+            to_date,
+            accounts,
+            ctx,
+            ignore_closing_entries,
+            ignore_opening_entries=ignore_opening_entries,
+            group_by_posting_date=True,
+            as_of=as_of,
+        )
+
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [
+            executor.submit(
+                get_accounting_entries_on_new_connection,
+                frappe.local.site,
+                frappe.local.sites_path,
+                frappe.session.user,
+                "GL Entry",
+                shard_from_date,
+                shard_to_date,
+                accounts,
+                ctx,
+                ignore_closing_entries,
+                ignore_opening_entries=ignore_opening_entries,
+                group_by_posting_date=True,
+                as_of=as_of,
+            )
+            for shard_from_date, shard_to_date in shards
+        ]
+
+        entries = []
+        for future in futures:
+            entries += future.result()
+
+    return entries
+
+
+def get_gl_shards(ctx, from_date, to_date, shard_count):
+    """
+    Split `from_date`..`to_date` into at most `shard_count` contiguous date ranges that end on
+    report period boundaries.
+    """
+    from_date, to_date = getdate(from_date), getdate(to_date)
+    boundaries = sorted(
+        {
+            getdate(period.to_date)
+            for period in get_value_periods(ctx)
+            if from_date <= getdate(period.to_date) < to_date
+        }
+    )
+    boundaries.append(to_date)
+
+    step = math.ceil(len(boundaries) / shard_count)
+    shard_ends = boundaries[step - 1 :: step]
+    if shard_ends[-1] != to_date:
+        shard_ends.append(to_date)
+
+    shards = []
+    for shard_end in shard_ends:
+        shards.append((from_date, shard_end))
+        from_date = getdate(add_days(shard_end, 1))
+
+    return shards
+
+
+def get_accounting_entries_on_new_connection(site, sites_path, user, *args, **kwargs):
+    """Run `get_accounting_entries` in a worker thread, on a connection of its own."""
+    frappe.init(site=site, sites_path=sites_path)
+    try:
+        frappe.connect()
+        frappe.set_user(user)
+        with use_report_replica():
+            return get_accounting_entries(*args, **kwargs)
+    finally:
+        frappe.destroy()
+
+
+def get_last_period_closing_voucher(company, before_date):
+    """
+    Return the latest submitted Period Closing Voucher ending before `before_date`, if any.
+    """
+    period_closing_vouchers = frappe.db.get_all(
+        "Period Closing Voucher",
+        filters={"docstatus": 1, "company": company, "period_end_date": ("<", before_date)},
+        fields=["name", "period_end_date"],
+        order_by="period_end_date desc",
+        limit=1,
+    )
+
+    return period_closing_vouchers[0] if period_closing_vouchers else None
+
+
+def get_opening_entries(
+    ctx,
+    opening_date,
+    accounts,
+    ignore_closing_entries,
+    ignore_opening_entries=False,
+    as_of=None,
+):
+    """
+    Fetch balances before `opening_date`, one aggregated row per account.
+
+    Balances up to the last Period Closing Voucher come from its Account Closing Balance
+    snapshot; only the GL delta since that closing is summed from `GL Entry`.
+    """
+    entries = []
+    from_date = None
+
+    last_period_closing_voucher = get_last_period_closing_voucher(ctx.company, opening_date)
+    if last_period_closing_voucher:
+        entries += get_accounting_entries(
+            "Account Closing Balance",
+            None,
+            None,
+            accounts,
+            ctx,
+            ignore_closing_entries,
+            period_closing_voucher=last_period_closing_voucher.name,
+            group_by_account=True,
+        )
+        # the snapshot covers everything up to the closing, opening entries included; the
+        # caller's `ignore_opening_entries` only applies to the GL delta after it
+        from_date = add_days(last_period_closing_voucher.period_end_date, 1)
+
+    if not from_date or getdate(from_date) < getdate(opening_date):
+        entries += get_accounting_entries(
+            "GL Entry",
+            from_date,
+            add_days(opening_date, -1),
+            accounts,
+            ctx,
+            ignore_closing_entries,
+            ignore_opening_entries=ignore_opening_entries,
+            group_by_account=True,
+            as_of=as_of,
+        )
+
+    # date the aggregated rows just before the opening date so that they count as opening balance
+    opening_posting_date = getdate(add_days(opening_date, -1))
+    for entry in entries:
+        entry.posting_date = opening_posting_date
+        entry.fiscal_year = None
+
+    return entries
+
+
 def get_accounting_entries(
     doctype,
     from_date,
     to_date,
     accounts,
-    filters,
+    ctx,
     ignore_closing_entries,
     period_closing_voucher=None,
     ignore_opening_entries=False,
+    group_by_account=False,
+    group_by_posting_date=False,
+    as_of=None,
+    changed_since=None,
+    cancelled=False,
 ):
     """
     Function to fetch GL accounting entries with additional conditions.
+
+    With `group_by_account`, one row per account is returned with summed amounts and
+    without the posting date columns. With `group_by_posting_date`, amounts are summed per
+    account and posting date, which is all the period bucketing needs.
+
+    `as_of` reads GL Entry as it was at that watermark: rows created by then and not yet
+    cancelled by then. With `changed_since`, only rows created after it are returned, or
+    with `cancelled`, rows created before it and cancelled after it.
     """
     gl_entry = frappe.qb.DocType(doctype)
-    query = (
-        frappe.qb.from_(gl_entry)
-        .select(
+    if group_by_account or group_by_posting_date:
+        query = (
+            frappe.qb.from_(gl_entry)
+            .select(
+                gl_entry.account,
+                Sum(gl_entry.debit).as_("debit"),
+                Sum(gl_entry.credit).as_("credit"),
+                Sum(gl_entry.debit_in_account_currency).as_("debit_in_account_currency"),
+                Sum(gl_entry.credit_in_account_currency).as_("credit_in_account_currency"),
+                gl_entry.account_currency,
+            )
+            .groupby(gl_entry.account, gl_entry.account_currency)
+        )
+    else:
+        query = frappe.qb.from_(gl_entry).select(
             gl_entry.account,
             gl_entry.debit,
             gl_entry.credit,
@@ -249,21 +1081,40 @@ def get_accounting_entries(
             gl_entry.credit_in_account_currency,
             gl_entry.account_currency,
         )
-        .where(gl_entry.company == filters.company)
-    )
+
+    query = query.where(gl_entry.company == ctx.company)
 
     if doctype == "GL Entry":
-        query = query.select(gl_entry.posting_date, gl_entry.is_opening, gl_entry.fiscal_year)
-        query = query.where(gl_entry.is_cancelled == 0)
+        if group_by_posting_date:
+            query = query.select(gl_entry.posting_date, gl_entry.fiscal_year)
+            query = query.groupby(gl_entry.posting_date, gl_entry.fiscal_year)
+        elif not group_by_account:
+            query = query.select(gl_entry.posting_date, gl_entry.is_opening, gl_entry.fiscal_year)
+        if cancelled:
+            query = query.where(gl_entry.is_cancelled == 1)
+            query = query.where(gl_entry.creation <= changed_since)
+            query = query.where(gl_entry.modified > changed_since)
+            if as_of:
+                query = query.where(gl_entry.modified <= as_of)
+        else:
+            if as_of:
+                # cancelling a row updates its `modified`
+                query = query.where(gl_entry.creation <= as_of)
+                query = query.where((gl_entry.is_cancelled == 0) | (gl_entry.modified > as_of))
+            else:
+                query = query.where(gl_entry.is_cancelled == 0)
+            if changed_since:
+                query = query.where(gl_entry.creation > changed_since)
         query = query.where(gl_entry.posting_date <= to_date)
 
         if ignore_opening_entries:
             query = query.where(gl_entry.is_opening == "No")
     else:
-        query = query.select(gl_entry.closing_date.as_("posting_date"))
+        if not group_by_account:
+            query = query.select(gl_entry.closing_date.as_("posting_date"))
         query = query.where(gl_entry.period_closing_voucher == period_closing_voucher)
 
-    query = apply_additional_conditions(doctype, query, from_date, ignore_closing_entries, filters)
+    query = apply_additional_conditions(doctype, query, from_date, ignore_closing_entries, ctx.gl_conditions)
     query = query.where(gl_entry.account.isin(accounts))
 
     entries = query.run(as_dict=True)
@@ -271,9 +1122,8 @@ def get_accounting_entries(
     return entries
 
 
-def apply_additional_conditions(doctype, query, from_date, ignore_closing_entries, filters):
+def apply_additional_conditions(doctype, query, from_date, ignore_closing_entries, gl_conditions):
     gl_entry = frappe.qb.DocType(doctype)
-    accounting_dimensions = get_accounting_dimensions(as_list=False)
 
     if ignore_closing_entries:
         if doctype == "GL Entry":
@@ -284,42 +1134,18 @@ def apply_additional_conditions(doctype, query, from_date, ignore_closing_entrie
     if from_date and doctype == "GL Entry":
         query = query.where(gl_entry.posting_date >= from_date)
 
-    if filters:
-        if filters.get("project"):
-            if not isinstance(filters.get("project"), list):
-                filters.project = frappe.parse_json(filters.get("project"))
-
-            query = query.where(gl_entry.project.isin(filters.project))
-
-        if filters.get("cost_center"):
-            filters.cost_center = get_cost_centers_with_children(filters.cost_center)
-            query = query.where(gl_entry.cost_center.isin(filters.cost_center))
-
-        if filters.get("include_default_book_entries"):
-            company_fb = frappe.get_cached_value("Company", filters.company, "default_finance_book")
-
-            if filters.finance_book and company_fb and cstr(filters.finance_book) != cstr(company_fb):
-                frappe.throw(_("To use a different finance book, please uncheck 'Include Default FB Entries'"))
+    if gl_conditions.project:
+        query = query.where(gl_entry.project.isin(gl_conditions.project))
 
-            query = query.where(
-                (gl_entry.finance_book.isin([cstr(filters.finance_book), cstr(company_fb), ""]))
-                | (gl_entry.finance_book.isnull())
-            )
-        else:
-            query = query.where(
-                (gl_entry.finance_book.isin([cstr(filters.finance_book), ""]))
-                | (gl_entry.finance_book.isnull())
-            )
+    if gl_conditions.cost_center:
+        query = query.where(gl_entry.cost_center.isin(gl_conditions.cost_center))
 
-    if accounting_dimensions:
-        for dimension in accounting_dimensions:
-            if filters.get(dimension.fieldname):
-                if frappe.get_cached_value("DocType", dimension.document_type, "is_tree"):
-                    filters[dimension.fieldname] = get_dimension_with_children(
-                        dimension.document_type, filters.get(dimension.fieldname)
-                    )
+    query = query.where(
+        (gl_entry.finance_book.isin(gl_conditions.finance_books)) | (gl_entry.finance_book.isnull())
+    )
 
-                query = query.where(gl_entry[dimension.fieldname].isin(filters[dimension.fieldname]))
+    for fieldname, values in gl_conditions.dimensions.items():
+        query = query.where(gl_entry[fieldname].isin(values))
 
     return query
 
@@ -327,13 +1153,17 @@ def apply_additional_conditions(doctype, query, from_date, ignore_closing_entrie
 def calculate_values(
     accounts_by_name,
     gl_entries_by_account,
-    period_list,
+    ctx,
     accumulated_values,
     ignore_accumulated_values_for_fy,
+    only_current_fiscal_year=True,
 ):
     """
     Calculate the values of accounts for each period.
     """
+    period_list = ctx.period_list
+    # budget periods are filled from the Budget doctype, not from GL entries
+    value_periods = period_list if ctx.compare_with == "Budget" else get_value_periods(ctx)
     for entries in gl_entries_by_account.values():
         for entry in entries:
             account = accounts_by_name.get(entry.account)
@@ -345,81 +1175,181 @@ def calculate_values(
                 )
                 continue  # Skip processing this entry if account is not found
 
-            for period in period_list:
+            amount = to_minor_units(entry.debit, ctx) - to_minor_units(entry.credit, ctx)
+
+            for period in value_periods:
+                # the scan may start before this period's year when comparing with the previous year
+                if only_current_fiscal_year and entry.posting_date < period.year_start_date:
+                    continue
+
                 # check if posting date is within the period
                 if entry.posting_date <= period.to_date:
                     if (accumulated_values or entry.posting_date >= period.from_date) and (
                         not ignore_accumulated_values_for_fy or entry.fiscal_year == period.to_date_fiscal_year
                     ):
-                        account[period.key] = account.get(period.key, 0.0) + flt(entry.debit) - flt(entry.credit)
+                        account[period.key] = account.get(period.key, 0) + amount
+
+            if not only_current_fiscal_year and entry.posting_date < period_list[0].year_start_date:
+                account["opening_balance"] = account.get("opening_balance", 0) + amount
+
 
-            if entry.posting_date < period_list[0].year_start_date:
-                account["opening_balance"] = account.get("opening_balance", 0.0) + flt(entry.debit) - flt(entry.credit)
 
+def set_budget_values(accounts_by_name, ctx, accumulated_values):
+    """
+    Fill the comparative periods with budgeted amounts, fetched in bulk from submitted Budgets
+    and spread over the months of each period by their Monthly Distribution (evenly if none).
+    Budgets are in company currency and converted like the GL side when a presentation
+    currency is set.
+    """
+    budget = frappe.qb.DocType("Budget")
+    budget_account = frappe.qb.DocType("Budget Account")
+
+    month_fiscal_years = {}
+    period_months = {}
+    for period in ctx.comparative_period_list:
+        month = get_first_day(period.year_start_date if accumulated_values else period.from_date)
+        months = []
+        while month <= period.to_date:
+            if month not in month_fiscal_years:
+                month_fiscal_years[month] = get_fiscal_year_name(month, ctx.company)
+            months.append(month)
+            month = getdate(add_months(month, 1))
+        period_months[period.key] = months
+
+    fiscal_years = list({fiscal_year for fiscal_year in month_fiscal_years.values() if fiscal_year})
+    if not fiscal_years:
+        return
+
+    query = (
+        frappe.qb.from_(budget)
+        .join(budget_account)
+        .on(budget_account.parent == budget.name)
+        .select(
+            budget_account.account,
+            budget.fiscal_year,
+            budget.monthly_distribution,
+            Sum(budget_account.budget_amount).as_("budget_amount"),
+        )
+        .where(budget.docstatus == 1)
+        .where(budget.company == ctx.company)
+        .where(budget.fiscal_year.isin(fiscal_years))
+        .where(budget_account.account.isin(list(accounts_by_name)))
+        .groupby(budget_account.account, budget.fiscal_year, budget.monthly_distribution)
+    )
+
+    if ctx.gl_conditions.cost_center:
+        query = query.where(budget.cost_center.isin(ctx.gl_conditions.cost_center))
+
+    if ctx.gl_conditions.project:
+        query = query.where(budget.project.isin(ctx.gl_conditions.project))
+
+    budgets = query.run(as_dict=True)
+    if not budgets:
+        return
+
+    distributions = {}
+    monthly_distributions = list({d.monthly_distribution for d in budgets if d.monthly_distribution})
+    if monthly_distributions:
+        for d in frappe.get_all(
+            "Monthly Distribution Percentage",
+            filters={"parent": ("in", monthly_distributions)},
+            fields=["parent", "month", "percentage_allocation"],
+        ):
+            distributions.setdefault(d.parent, {})[d.month] = flt(d.percentage_allocation)
+
+    budgets_by_account = {}
+    for d in budgets:
+        budgets_by_account.setdefault(d.account, []).append(d)
+
+    for account_name, account_budgets in budgets_by_account.items():
+        account = accounts_by_name[account_name]
+        # values are kept as (debit - credit), income budgets are credits
+        sign = -1 if account.root_type == "Income" else 1
+
+        for period in ctx.comparative_period_list:
+            amount = 0.0
+            for month in period_months[period.key]:
+                for d in account_budgets:
+                    if d.fiscal_year != month_fiscal_years[month]:
+                        continue
+
+                    if d.monthly_distribution:
+                        percentage = distributions.get(d.monthly_distribution, {}).get(month.strftime("%B"), 0.0)
+                    else:
+                        percentage = 100.0 / 12
+
+                    amount += flt(d.budget_amount) * percentage / 100
+
+            if ctx.currency_info:
+                amount = convert(
+                    amount,
+                    ctx.currency_info["presentation_currency"],
+                    ctx.currency_info["company_currency"],
+                    ctx.currency_info["report_date"],
+                )
 
+            account[period.key] = sign * to_minor_units(amount, ctx)
 
 
-def accumulate_values_into_parents(accounts, accounts_by_name, period_list):
+def accumulate_values_into_parents(accounts, accounts_by_name, ctx):
     """
     Accumulate the values from child accounts into their parent accounts.
     """
+    period_list = get_value_periods(ctx)
     for account in reversed(accounts):
         if account.parent_account:
             for period in period_list:
                 accounts_by_name[account.parent_account][period.key] = accounts_by_name[account.parent_account].get(
-                    period.key, 0.0
-                ) + account.get(period.key, 0.0)
+                    period.key, 0
+                ) + account.get(period.key, 0)
 
             accounts_by_name[account.parent_account]["opening_balance"] = accounts_by_name[account.parent_account].get(
-                "opening_balance", 0.0
-            ) + account.get("opening_balance", 0.0)
+                "opening_balance", 0
+            ) + account.get("opening_balance", 0)
 
 
-def prepare_data(accounts, balance_must_be, period_list, company_currency):
+def prepare_data(accounts, balance_must_be, ctx):
     """
     Prepare the data for display in the report.
     """
     data = []
-    year_start_date = period_list[0]["year_start_date"].strftime("%Y-%m-%d")
-    year_end_date = period_list[-1]["year_end_date"].strftime("%Y-%m-%d")
+    labels = get_account_labels(ctx)
+    value_keys = [(period.key, not period.get("current_key")) for period in get_value_periods(ctx)]
+    # change sign based on Debit or Credit, since calculation is done using (debit - credit)
+    sign = -1 if balance_must_be == "Credit" else 1
+    opening_sign = 1 if balance_must_be == "Debit" else -1
 
     for account in accounts:
         # add to output
         has_value = False
         total = 0
+        account_label, parent_account_label, account_name = labels.get(account.name) or get_account_label(account)
         row = frappe._dict(
-            {
-                "account": _(account.name),
-                "parent_account": _(account.parent_account) if account.parent_account else "",
-                "indent": flt(account.indent),
-                "year_start_date": year_start_date,
-                "year_end_date": year_end_date,
-                "currency": company_currency,
-                "include_in_gross": account.include_in_gross,
-                "account_type": account.account_type,
-                "is_group": account.is_group,
-                "opening_balance": account.get("opening_balance", 0.0) * (1 if balance_must_be == "Debit" else -1),
-                "account_name": (
-                    "%s - %s" % (_(account.account_number), _(account.account_name))
-                    if account.account_number
-                    else _(account.account_name)
-                ),
-            }
+            account=account_label,
+            parent_account=parent_account_label,
+            indent=flt(account.indent),
+            year_start_date=ctx.year_start_date,
+            year_end_date=ctx.year_end_date,
+            currency=ctx.currency,
+            include_in_gross=account.include_in_gross,
+            account_type=account.account_type,
+            is_group=account.is_group,
+            opening_balance=from_minor_units(opening_sign * account.get("opening_balance", 0), ctx),
+            account_name=account_name,
         )
-        for period in period_list:
-            if account.get(period.key) and balance_must_be == "Credit":
-                # change sign based on Debit or Credit, since calculation is done using (debit - credit)
-                account[period.key] *= -1
+        for key, is_current in value_keys:
+            value = sign * account.get(key, 0)
+            row[key] = from_minor_units(value, ctx)
 
-            row[period.key] = flt(account.get(period.key, 0.0), 3)
-
-            if abs(row[period.key]) >= 0.005:
+            if value:
                 # ignore zero values
                 has_value = True
-                total += flt(row[period.key])
+                if is_current:
+                    total += value
 
+        set_variance(row, ctx)
         row["has_value"] = has_value
-        row["total"] = total
+        row["total"] = from_minor_units(total, ctx)
         data.append(row)
 
     return data
@@ -445,28 +1375,58 @@ def filter_out_zero_value_rows(data, parent_children_map, show_zero_values=False
     return data_with_value
 
 
-def add_total_row(out, root_type, balance_must_be, period_list, company_currency):
+def limit_tree_depth(data, depth):
+    """
+    Keep the rows above `depth`. Rows whose children are cut off are flagged with
+    `lazy_children` so that the client can fetch them on expand.
+    """
+    parents = {row.get("parent_account") for row in data if row.get("parent_account")}
+
+    out = []
+    for row in data:
+        indent = row.get("indent")
+        if indent is not None and indent >= depth:
+            continue
+
+        if indent is not None and indent == depth - 1 and row.get("account") in parents:
+            row = dict(row, lazy_children=1)
+
+        out.append(row)
+
+    return out
+
+
+def add_total_row(out, root_type, balance_must_be, ctx, root_accounts):
     """
     Add a total row at the end of the report for the specified root type (e.g., Income, Expense).
+    Totals come from the root accounts, which already hold the rolled-up values in minor units.
     """
+    total_label = _("Total {0} ({1})").format(_(root_type), _(balance_must_be))
     total_row = {
-        "account_name": _("Total {0} ({1})").format(_(root_type), _(balance_must_be)),
-        "account": _("Total {0} ({1})").format(_(root_type), _(balance_must_be)),
-        "currency": company_currency,
+        "account_name": total_label,
+        "account": total_label,
+        "currency": ctx.currency,
         "opening_balance": 0.0,
     }
 
-    for row in out:
-        if not row.get("parent_account"):
-            for period in period_list:
-                total_row.setdefault(period.key, 0.0)
-                total_row[period.key] += row.get(period.key, 0.0)
+    if root_accounts:
+        sign = -1 if balance_must_be == "Credit" else 1
+        opening_sign = 1 if balance_must_be == "Debit" else -1
+        total = 0
 
-            total_row.setdefault("total", 0.0)
-            total_row["total"] += flt(row["total"])
-            total_row["opening_balance"] += row["opening_balance"]
+        for period in get_value_periods(ctx):
+            value = sign * sum(account.get(period.key, 0) for account in root_accounts)
+            total_row[period.key] = from_minor_units(value, ctx)
+            if not period.get("current_key"):
+                total += value
+
+        total_row["total"] = from_minor_units(total, ctx)
+        total_row["opening_balance"] = from_minor_units(
+            opening_sign * sum(account.get("opening_balance", 0) for account in root_accounts), ctx
+        )
 
     if "total" in total_row:
+        set_variance(total_row, ctx)
         out.append(total_row)
 
         # Append a blank row after Total for spacing
@@ -18,9 +18,135 @@
 //     }, 1000);  // Delay for 1 second to allow for report rendering
 // };
 
+// Sections published by the progressive run, in display order
+const P_AND_L_SECTIONS = ["income", "cogs", "opex", "taxes_zakat"];
+
+function on_p_and_l_progress(report, message) {
+	if (!report.get_filter_value("progressive_loading")) {
+		return;
+	}
+
+	// events may arrive before the response naming our task, keep them until it does
+	report.p_and_l_pending = report.p_and_l_pending || {};
+	(report.p_and_l_pending[message.task_id] = report.p_and_l_pending[message.task_id] || []).push(message);
+	flush_p_and_l_progress(report);
+}
+
+function flush_p_and_l_progress(report) {
+	// the placeholder row returned by start_progressive_run names the task of this view
+	const placeholder = (report.data || [])[0];
+	if (placeholder && placeholder.p_and_l_task_id && placeholder.p_and_l_task_id !== report.p_and_l_task_id) {
+		report.p_and_l_task_id = placeholder.p_and_l_task_id;
+		report.p_and_l_sections = {};
+	}
+
+	const task_id = report.p_and_l_task_id;
+	const messages = (report.p_and_l_pending || {})[task_id] || [];
+	if (!task_id || !messages.length) {
+		return;
+	}
+
+	// events of other tasks belong to runs this view no longer shows
+	report.p_and_l_pending = {};
+	messages.forEach((message) => render_p_and_l_progress(report, message));
+}
+
+function render_p_and_l_progress(report, message) {
+	if (message.error) {
+		frappe.msgprint(message.error);
+		return;
+	}
+
+	let data;
+	if (message.done) {
+		// final payload carries the derived profit rows as well
+		data = message.data;
+	} else {
+		report.p_and_l_sections[message.section] = message.rows;
+		data = [].concat(...P_AND_L_SECTIONS.map((section) => report.p_and_l_sections[section] || []));
+	}
+
+	report.data = data;
+	if (report.datatable) {
+		report.datatable.refresh(data);
+	}
+
+	if (message.done && message.report_summary && report.render_summary) {
+		report.render_summary(message.report_summary);
+	}
+}
+
+function expand_p_and_l_account(report, section, parent_account) {
+	frappe.call({
+		method: "worldrep_report.worldrep_report.report.p_and_l.p_and_l.get_account_children",
+		args: {
+			filters: report.get_filter_values(),
+			section: section,
+			parent_account: parent_account,
+		},
+		callback: (r) => {
+			const data = report.data || [];
+			const index = data.findIndex((row) => row.section === section && row.account === parent_account);
+			if (index === -1) {
+				return;
+			}
+
+			data[index] = Object.assign({}, data[index], { lazy_children: 0 });
+			data.splice(index + 1, 0, ...(r.message || []));
+
+			report.data = data;
+			report.datatable.refresh(data);
+		},
+	});
+}
+
 frappe.require("assets/erpnext/js/financial_statements.js", function () {
 	frappe.query_reports["P and L"] = $.extend({}, erpnext.financial_statements);
 
+	const base_onload = frappe.query_reports["P and L"].onload;
+	frappe.query_reports["P and L"].onload = function (report) {
+		if (base_onload) {
+			base_onload(report);
+		}
+
+		frappe.realtime.off("p_and_l_progress");
+		frappe.realtime.on("p_and_l_progress", (message) => on_p_and_l_progress(report, message));
+
+		report.page.wrapper.on("click", ".p-and-l-expand", function (e) {
+			e.preventDefault();
+			e.stopPropagation();
+			expand_p_and_l_account(
+				report,
+				$(this).attr("data-section"),
+				decodeURIComponent($(this).attr("data-account"))
+			);
+		});
+	};
+
+	const base_after_datatable_render = frappe.query_reports["P and L"].after_datatable_render;
+	frappe.query_reports["P and L"].after_datatable_render = function (datatable) {
+		if (base_after_datatable_render) {
+			base_after_datatable_render(datatable);
+		}
+
+		// replay the events that arrived before the response
+		if (frappe.query_report) {
+			flush_p_and_l_progress(frappe.query_report);
+		}
+	};
+
+	const base_formatter = frappe.query_reports["P and L"].formatter;
+	frappe.query_reports["P and L"].formatter = function (value, row, column, data, default_formatter) {
+		value = base_formatter(value, row, column, data, default_formatter);
+
+		if (data && data.lazy_children && column.fieldname === "account") {
+			value += ` <a class="p-and-l-expand" data-section="${data.section}"
+				data-account="${encodeURIComponent(data.account)}">${__("Show More")}</a>`;
+		}
+
+		return value;
+	};
+
 	erpnext.utils.add_dimensions("P and L", 10);
 
 	frappe.query_reports["P and L"]["filters"].push({
@@ -36,6 +162,31 @@ frappe.require("assets/erpnext/js/financial_statements.js", function () {
 		reqd: 1,
 	});
 
+	frappe.query_reports["P and L"]["filters"].push({
+		fieldname: "compare_with",
+		label: __("Compare With"),
+		fieldtype: "Select",
+		options: [
+			{ value: "", label: __("None") },
+			{ value: "Previous Year", label: __("Previous Year") },
+			{ value: "Budget", label: __("Budget") },
+		],
+	});
+
+	frappe.query_reports["P and L"]["filters"].push({
+		fieldname: "lazy_tree_depth",
+		label: __("Load Accounts Up To Level"),
+		fieldtype: "Int",
+		description: __("Deeper accounts are loaded on expand. Leave empty to load all levels."),
+	});
+
+	frappe.query_reports["P and L"]["filters"].push({
+		fieldname: "progressive_loading",
+		label: __("Load Sections Progressively"),
+		fieldtype: "Check",
+		default: 0,
+	});
+
 	frappe.query_reports["P and L"]["filters"].push({
 		fieldname: "include_default_book_entries",
 		label: __("Include Default Book Entries"),
@@ -1,73 +1,219 @@
 import frappe
 from frappe import _
-from frappe.utils import flt
+from frappe.utils import cint, flt
 
 from erpnext.accounts.report.financial_statements import (
     get_columns,
     get_filtered_list_for_consolidated_report,
-    get_period_list,
 )
-from worldrep_report.utils import get_data_with_account_type  # Assuming this is where the custom function is located.
+from worldrep_report.utils import (
+    REPORT_CACHE_TTL,
+    from_minor_units,
+    get_data_with_account_type,
+    get_report_cache_key,
+    get_report_context,
+    get_shared_cache,
+    get_value_periods,
+    limit_tree_depth,
+    set_variance,
+    sum_minor_units,
+    to_minor_units,
+    use_report_replica,
+)
+
+# Report sections in display order, with the arguments used to fetch each of them
+SECTIONS = (
+    ("income", {"root_type": "Income", "balance_must_be": "Credit"}),
+    ("cogs", {"root_type": "Expense", "account_type": "Cost of Goods Sold", "balance_must_be": "Debit"}),
+    (
+        "opex",
+        {
+            "root_type": "Expense",
+            # Exclude COGS and Taxes from general expenses
+            "exclude_account_type": ["Cost of Goods Sold", "Tax"],
+            "balance_must_be": "Debit",
+        },
+    ),
+    ("taxes_zakat", {"root_type": "Expense", "account_type": "Tax", "balance_must_be": "Debit"}),
+)
+
+PROGRESS_EVENT = "p_and_l_progress"
 
+
+@use_report_replica()
 def execute(filters=None):
-    period_list = get_period_list(
-        filters.from_fiscal_year,
-        filters.to_fiscal_year,
-        filters.period_start_date,
-        filters.period_end_date,
-        filters.filter_based_on,
-        filters.periodicity,
-        company=filters.company,
-    )
+    # company lookups, period list and GL filter state are resolved once per run
+    ctx = get_report_context(filters)
+
+    if cint(ctx.filters.get("progressive_loading")):
+        return start_progressive_run(ctx, filters)
+
+    return get_report(ctx, get_sections(ctx))
+
+
+@frappe.whitelist()
+@use_report_replica()
+def execute_batch(filters_list):
+    """
+    Run the report for many filter sets at once. Filter sets are grouped by company and date
+    range; each group shares one account snapshot and one GL scan per distinct set of GL filters.
+    Results are returned in the order of `filters_list`. The caller needs access to every
+    company in `filters_list`.
+    """
+    if not frappe.get_cached_doc("Report", "P and L").is_permitted():
+        frappe.throw(_("You are not permitted to view this report."), frappe.PermissionError)
+
+    filters_list = frappe.parse_json(filters_list)
+    for filters in filters_list:
+        if not frappe.has_permission("Company", doc=filters.get("company")):
+            frappe.throw(
+                _("You are not permitted to view the P and L of {0}.").format(filters.get("company")),
+                frappe.PermissionError,
+            )
+
+    shared = get_shared_cache()
+
+    groups = {}
+    for idx, filters in enumerate(filters_list):
+        ctx = get_report_context(filters, shared=shared)
+        group_key = (ctx.company, ctx.period_list[0]["year_start_date"], ctx.period_list[-1]["to_date"])
+        groups.setdefault(group_key, []).append((idx, ctx))
+
+    results = [None] * len(filters_list)
+    for group in groups.values():
+        for idx, ctx in group:
+            columns, data, message, chart, report_summary = get_report(ctx, get_sections(ctx))
+            results[idx] = {
+                "filters": filters_list[idx],
+                "columns": columns,
+                "data": data,
+                "report_summary": report_summary,
+            }
+
+        # GL scans are not shared across date ranges, release them before the next group
+        shared.gl_entries.clear()
+
+    return results
+
+
+def get_sections(ctx, on_section=None):
+    """
+    Fetch every report section. In lazy tree mode the full section rows are cached, so that
+    `get_account_children` can serve the rows below the requested depth.
+    """
+    sections = {}
+    for section, kwargs in SECTIONS:
+        rows = get_data_with_account_type(ctx, **kwargs)
+
+        if ctx.tree_depth and rows:
+            for row in rows:
+                row["section"] = section
+
+            frappe.cache().set_value(
+                get_report_cache_key(ctx, section), rows, expires_in_sec=REPORT_CACHE_TTL
+            )
+
+        sections[section] = rows
+        if on_section:
+            on_section(section, rows)
+
+    return sections
+
+
+@frappe.whitelist()
+@use_report_replica()
+def get_account_children(filters, section, parent_account):
+    """Return the rows directly below `parent_account` in a section, for lazy tree expansion."""
+    if not frappe.get_cached_doc("Report", "P and L").is_permitted():
+        frappe.throw(_("You are not permitted to view this report."), frappe.PermissionError)
+
+    section_kwargs = dict(SECTIONS).get(section)
+    if not section_kwargs:
+        frappe.throw(_("Invalid report section {0}").format(section))
+
+    ctx = get_report_context(frappe.parse_json(filters))
+    rows = frappe.cache().get_value(get_report_cache_key(ctx, section))
+    if rows is None:
+        rows = get_data_with_account_type(ctx, **section_kwargs) or []
+        for row in rows:
+            row["section"] = section
+
+        frappe.cache().set_value(get_report_cache_key(ctx, section), rows, expires_in_sec=REPORT_CACHE_TTL)
+
+    parents = {row.get("parent_account") for row in rows if row.get("parent_account")}
 
-    filters.period_start_date = period_list[0]["year_start_date"]
+    return [
+        dict(row, lazy_children=1) if row.get("account") in parents else row
+        for row in rows
+        if row.get("parent_account") == parent_account
+    ]
 
-    currency = filters.presentation_currency or frappe.get_cached_value(
-        "Company", filters.company, "default_currency"
-    )
 
-    # Fetch data for Income, COGS, and Expenses using the custom function
-    income = get_data_with_account_type(
-        filters['company'],
-        root_type="Income",
-        account_type=None,  # No specific account type
-        balance_must_be="Credit",
-        period_list=period_list,
-        filters=filters,
-    )
+def start_progressive_run(ctx, filters):
+    """
+    Compute the report in a background job that publishes every section over realtime as soon
+    as it is ready. Only the columns and a placeholder row are returned right away; the
+    placeholder carries the task id so the client only renders the events of its own run.
 
-    cogs = get_data_with_account_type(
-        filters['company'],
-        root_type="Expense",
-        account_type="Cost of Goods Sold",  # Specify the account type for COGS
-        balance_must_be="Debit",
-        period_list=period_list,
+    The job is enqueued right away: the run itself writes nothing to commit, and may be on the
+    read replica connection.
+    """
+    task_id = frappe.generate_hash(length=10)
+    frappe.enqueue(
+        run_progressive_report,
+        queue="long",
         filters=filters,
+        task_id=task_id,
+        user=frappe.session.user,
     )
 
-    expenses_excluding_cogs = get_data_with_account_type(
-        filters['company'],
-        root_type="Expense",
-        exclude_account_type=["Cost of Goods Sold", "Tax"],  # Exclude COGS and Taxes from general expenses
-        balance_must_be="Debit",
-        period_list=period_list,
-        filters=filters,
-    )
-    
-    taxes_zakat = get_data_with_account_type(
-        filters['company'],
-        root_type="Expense",
-        account_type="Tax",
-        balance_must_be="Debit",
-        period_list=period_list,
-        filters=filters,
-    )                
+    placeholder = {"account_name": _("Loading..."), "account": _("Loading..."), "p_and_l_task_id": task_id}
+    return get_report_columns(ctx), [placeholder], None, None, None
+
+
+@use_report_replica()
+def run_progressive_report(filters, task_id, user):
+    ctx = get_report_context(filters)
+
+    def on_section(section, rows):
+        rows = rows or []
+        if ctx.tree_depth:
+            rows = limit_tree_depth(rows, ctx.tree_depth)
+
+        publish_progress(task_id, user, section=section, rows=rows)
+
+    try:
+        sections = get_sections(ctx, on_section=on_section)
+
+        # derived profit rows and the summary need every section
+        columns, data, message, chart, report_summary = get_report(ctx, sections)
+        publish_progress(task_id, user, done=1, data=data, report_summary=report_summary)
+    except Exception:
+        publish_progress(task_id, user, error=_("Could not load the P and L report. Please try again."))
+        raise
+
+
+def publish_progress(task_id, user, **message):
+    frappe.publish_realtime(PROGRESS_EVENT, dict(message, task_id=task_id), user=user)
+
+
+def get_report(ctx, sections):
+    period_list = ctx.period_list
+    income = sections["income"]
+    cogs = sections["cogs"]
+    expenses_excluding_cogs = sections["opex"]
+    taxes_zakat = sections["taxes_zakat"]
 
     # Calculate Gross Profit
-    gross_profit = calculate_gross_profit(income, cogs, period_list, filters['company'], filters.get('presentation_currency'))
+    gross_profit = calculate_gross_profit(income, cogs, ctx)
 
     # Calculate Net Profit/Loss excluding COGS in expenses
-    net_profit_loss_excluding_cogs = calculate_net_profit_loss(gross_profit, expenses_excluding_cogs, period_list, filters['company'], filters.get('presentation_currency'))
+    net_profit_loss_excluding_cogs = calculate_net_profit_loss(gross_profit, expenses_excluding_cogs, ctx)
+
+    # Section totals are shown for the last period (and its comparative period, if any)
+    last_keys = [period_list[-1].key]
+    if ctx.comparative_period_list:
+        last_keys.append(ctx.comparative_period_list[-1].key)
 
     # Compile the data for the report
     data = []
@@ -79,8 +225,9 @@ def execute(filters=None):
         
         # Add "Total COGS"
         total_cogs = {"account_name": _("Total COGS"), "account": _("Total COGS"), "total": True}
-        total_cogs_value = sum(flt(item.get(period_list[-1].key, 0)) for item in cogs if item.get('indent') == 0)
-        total_cogs[period_list[-1].key] = total_cogs_value
+        for key in last_keys:
+            total_cogs[key] = from_minor_units(sum_minor_units(cogs, key, ctx, root_only=True), ctx)
+        set_variance(total_cogs, ctx)
         data.append(total_cogs)
     
     if gross_profit:
@@ -95,8 +242,11 @@ def execute(filters=None):
         
         # Calculate and display the total expenses excluding COGS and Taxes
         total_expense_excluding_cogs = {"account_name": _("Total OPEX"), "account": _("Total OPEX"), "total": True}
-        total_expense_value = sum(flt(item.get(period_list[-1].key, 0)) for item in expenses_excluding_cogs if item.get('indent') == 0)
-        total_expense_excluding_cogs[period_list[-1].key] = total_expense_value
+        for key in last_keys:
+            total_expense_excluding_cogs[key] = from_minor_units(
+                sum_minor_units(expenses_excluding_cogs, key, ctx, root_only=True), ctx
+            )
+        set_variance(total_expense_excluding_cogs, ctx)
         data.append(total_expense_excluding_cogs)
 
     # Ensure that total_expense_excluding_cogs is not None before using it
@@ -105,115 +255,142 @@ def execute(filters=None):
             "account_name": _("Profit from Operations"),
             "account": _("Profit from Operations"),
             "warn_if_negative": True,
-            "currency": filters.get('presentation_currency') or frappe.get_cached_value("Company", filters['company'], "default_currency"),
+            "currency": ctx.currency,
         }
 
-        profit_from_operations_value = gross_profit[period_list[-1].key] - total_expense_excluding_cogs[period_list[-1].key]
-        profit_from_operations[period_list[-1].key] = profit_from_operations_value
+        for key in last_keys:
+            profit_from_operations[key] = from_minor_units(
+                to_minor_units(gross_profit[key], ctx) - to_minor_units(total_expense_excluding_cogs[key], ctx), ctx
+            )
+        set_variance(profit_from_operations, ctx)
         data.append(profit_from_operations)
 
         
     # Add Taxes and Zakat section
     if taxes_zakat:
-        taxes_zakat_total = sum(flt(tax.get(period_list[-1].key, 0)) for tax in taxes_zakat if tax.get('indent') == 0)
         taxes_zakat_data = {"account_name": _("Taxes and Zakat"), "account": _("Taxes and Zakat"), "total": True}
-        taxes_zakat_data[period_list[-1].key] = taxes_zakat_total
+        for key in last_keys:
+            taxes_zakat_data[key] = from_minor_units(sum_minor_units(taxes_zakat, key, ctx, root_only=True), ctx)
+        set_variance(taxes_zakat_data, ctx)
         data.append(taxes_zakat_data)
         data.extend(taxes_zakat)
     
     if net_profit_loss_excluding_cogs and flt(net_profit_loss_excluding_cogs.get("total", 0)) > 0:
         data.append(net_profit_loss_excluding_cogs)
 
+    if ctx.tree_depth:
+        data = limit_tree_depth(data, ctx.tree_depth)
+
     # Get columns for the report
+    columns = get_report_columns(ctx)
+
+    # Generate report summary
+    report_summary = get_report_summary(ctx, income, expenses_excluding_cogs, net_profit_loss_excluding_cogs)
+
+    return columns, data, None, None, report_summary
+
+
+def get_report_columns(ctx):
     columns = get_columns(
-        filters['periodicity'], period_list, filters.get('accumulated_values'), filters['company']
+        ctx.filters.periodicity, ctx.period_list, ctx.filters.get('accumulated_values'), ctx.company
     )
+    if ctx.comparative_period_list:
+        columns = add_comparative_columns(columns, ctx)
 
-    # Get currency for the report
-    currency = filters.get('presentation_currency') or frappe.get_cached_value(
-        "Company", filters['company'], "default_currency"
-    )
+    return columns
 
-    # Generate report summary
-    report_summary = get_report_summary(
-        period_list, filters['periodicity'], income, expenses_excluding_cogs, net_profit_loss_excluding_cogs, currency, filters
-    )
 
-    return columns, data, None, None, report_summary
+def add_comparative_columns(columns, ctx):
+    """Place the comparative and variance columns right after each period column."""
+    comparative_periods = {period.current_key: period for period in ctx.comparative_period_list}
 
+    out = []
+    for column in columns:
+        out.append(column)
+        period = comparative_periods.get(column.get("fieldname"))
+        if period:
+            out.append(dict(column, fieldname=period.key, label=period.label))
+            out.append(dict(column, fieldname=period.variance_key, label=period.variance_label))
 
+    return out
 
-def calculate_gross_profit(income, cogs, period_list, company, currency=None):
+
+def calculate_gross_profit(income, cogs, ctx):
     gross_profit = {
         "account_name": _("Gross Profit"),
         "account": _("Gross Profit"),
         "warn_if_negative": True,
-        "currency": currency or frappe.get_cached_value("Company", company, "default_currency"),
+        "currency": ctx.currency,
     }
 
     total_gross_profit = 0
 
-    for period in period_list:
+    for period in get_value_periods(ctx):
         key = period.key
 
-        period_income = sum(flt(income_item.get(key, 0), 3) for income_item in income if income_item.get('indent') == 0)
-        period_cogs = sum(flt(cogs_item.get(key, 0), 3) for cogs_item in cogs if cogs_item.get('indent') == 0)
+        period_income = sum_minor_units(income, key, ctx, root_only=True)
+        period_cogs = sum_minor_units(cogs, key, ctx, root_only=True)
 
         gross_profit_for_period = period_income - period_cogs
 
-        gross_profit[key] = gross_profit_for_period
-        total_gross_profit += gross_profit_for_period
+        gross_profit[key] = from_minor_units(gross_profit_for_period, ctx)
+        if not period.get("current_key"):
+            total_gross_profit += gross_profit_for_period
 
-    gross_profit["total"] = total_gross_profit
+    gross_profit["total"] = from_minor_units(total_gross_profit, ctx)
+    set_variance(gross_profit, ctx)
 
     return gross_profit
 
 
 
 
-def calculate_net_profit_loss(gross_profit, expenses, period_list, company, currency=None):
+def calculate_net_profit_loss(gross_profit, expenses, ctx):
     net_profit_loss = {
         "account_name": _("Net Profit for the year"),
         "account": _("Net Profit for the year"),
         "warn_if_negative": True,
-        "currency": currency or frappe.get_cached_value("Company", company, "default_currency"),
+        "currency": ctx.currency,
     }
 
     total_net_profit = 0
 
-    for period in period_list:
+    for period in get_value_periods(ctx):
         key = period.key
         
-        total_gross_profit = flt(gross_profit.get(key), 3) if gross_profit else 0
-        
-        # Ensure expenses is not None before iterating
-        total_expense = 0
-        if expenses:
-            total_expense = sum(flt(expense_item.get(key, 0), 3) for expense_item in expenses)
+        total_gross_profit = to_minor_units(gross_profit.get(key), ctx) if gross_profit else 0
+        total_expense = sum_minor_units(expenses, key, ctx)
 
         net_profit_for_period = total_gross_profit - total_expense
-        net_profit_loss[key] = net_profit_for_period
+        net_profit_loss[key] = from_minor_units(net_profit_for_period, ctx)
 
-        total_net_profit += net_profit_for_period
+        if not period.get("current_key"):
+            total_net_profit += net_profit_for_period
 
-    net_profit_loss["total"] = total_net_profit
+    net_profit_loss["total"] = from_minor_units(total_net_profit, ctx)
+    set_variance(net_profit_loss, ctx)
 
     return net_profit_loss
 
-def get_report_summary(period_list, periodicity, income, expense, net_profit_loss, currency, filters):
-    net_income, net_expense, net_profit = 0.0, 0.0, 0.0
+def get_report_summary(ctx, income, expense, net_profit_loss):
+    net_income, net_expense, net_profit = 0, 0, 0
+    period_list = ctx.period_list
+    periodicity = ctx.filters.periodicity
+    currency = ctx.currency
 
-    if filters.get("accumulated_in_group_company"):
-        period_list = get_filtered_list_for_consolidated_report(filters, period_list)
+    if ctx.filters.get("accumulated_in_group_company"):
+        period_list = get_filtered_list_for_consolidated_report(ctx.filters, period_list)
 
     for period in period_list:
         key = period.key
-        if income:
-            net_income += sum(flt(income_item.get(key, 0)) for income_item in income)
-        if expense:
-            net_expense += sum(flt(expense_item.get(key, 0)) for expense_item in expense)
+        net_income += sum_minor_units(income, key, ctx)
+        net_expense += sum_minor_units(expense, key, ctx)
         if net_profit_loss:
-            net_profit += net_profit_loss.get(key)
+            net_profit += to_minor_units(net_profit_loss.get(key), ctx)
+
+    net_income = from_minor_units(net_income, ctx)
+    net_expense = from_minor_units(net_expense, ctx)
+    net_profit = from_minor_units(net_profit, ctx)
 
     if len(period_list) == 1 and periodicity == "Yearly":
         profit_label = _("Profit This Year")
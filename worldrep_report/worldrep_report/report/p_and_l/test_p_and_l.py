@@ -0,0 +1,540 @@
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, add_months, add_to_date, get_last_day, getdate, now_datetime
+
+from erpnext.accounts.utils import FiscalYearError
+
+from worldrep_report.tasks import get_month_end_pack
+from worldrep_report.utils import (
+    GL_DELTA_MAX_AGE,
+    GL_COMMIT_WINDOW,
+    GL_DELTA_MAX_COUNT,
+    accumulate_values_into_parents,
+    add_total_row,
+    can_apply_gl_delta,
+    clear_account_snapshot,
+    from_minor_units,
+    get_account_snapshot_cache_key,
+    get_accounting_entries,
+    get_comparative_period_list,
+    get_gl_delta_entries,
+    get_gl_entries_by_account,
+    get_gl_settled_mark,
+    get_gl_shards,
+    get_opening_entries,
+    get_report_cache_key,
+    limit_tree_depth,
+    prepare_data,
+    sum_minor_units,
+    to_minor_units,
+    use_report_replica,
+)
+from worldrep_report.worldrep_report.report.p_and_l import p_and_l
+
+
+def get_monthly_periods(year_start_date="2026-01-01", months=12):
+    periods = []
+    from_date = getdate(year_start_date)
+    for _ in range(months):
+        to_date = get_last_day(from_date)
+        periods.append(
+            frappe._dict(
+                key=to_date.strftime("%b_%Y").lower(),
+                label=to_date.strftime("%b %Y"),
+                from_date=from_date,
+                to_date=to_date,
+                year_start_date=getdate(year_start_date),
+                year_end_date=getdate(add_days(add_months(year_start_date, 12), -1)),
+            )
+        )
+        from_date = getdate(add_days(to_date, 1))
+
+    return periods
+
+
+def get_test_context(precision=2, **kwargs):
+    return frappe._dict(
+        precision=precision,
+        scale=10**precision,
+        period_list=get_monthly_periods(),
+        comparative_period_list=[],
+        currency_info=None,
+        company="_Test Company",
+        gl_conditions=frappe._dict(project=None, cost_center=None, finance_books=[""], dimensions={}),
+        **kwargs,
+    )
+
+
+def get_delta_entry(credit):
+    return frappe._dict(
+        account="Sales",
+        debit=0,
+        credit=credit,
+        debit_in_account_currency=0,
+        credit_in_account_currency=credit,
+    )
+
+
+def connect_mock_replica():
+    frappe.local.primary_db = frappe.local.db
+    frappe.local.replica_db = frappe.local.db = MagicMock()
+    return True
+
+
+class TestPandL(FrappeTestCase):
+    def test_comparative_periods_without_previous_fiscal_year(self):
+        period_list = get_monthly_periods(months=2)
+        with patch("worldrep_report.utils.get_fiscal_year", side_effect=FiscalYearError):
+            comparative_period_list = get_comparative_period_list(period_list, "Previous Year", "_Test Company")
+
+        self.assertEqual(len(comparative_period_list), 2)
+        self.assertIsNone(comparative_period_list[0].to_date_fiscal_year)
+        self.assertEqual(comparative_period_list[0].to_date, getdate("2025-01-31"))
+        self.assertEqual(comparative_period_list[0].current_key, period_list[0].key)
+
+    def test_comparative_periods_over_leap_day(self):
+        # fiscal year March 2024 - February 2025, compared with March 2023 - February 2024
+        period_list = get_monthly_periods(year_start_date="2024-03-01")
+        with patch("worldrep_report.utils.get_fiscal_year", return_value=("2023-2024",)):
+            comparative_period_list = get_comparative_period_list(period_list, "Previous Year", "_Test Company")
+
+        february = comparative_period_list[-1]
+        self.assertEqual(february.from_date, getdate("2024-02-01"))
+        self.assertEqual(february.to_date, getdate("2024-02-29"))
+        self.assertEqual(february.year_start_date, getdate("2023-03-01"))
+        self.assertEqual(february.year_end_date, getdate("2024-02-29"))
+
+        # comparative periods are contiguous
+        for period, next_period in zip(comparative_period_list, comparative_period_list[1:]):
+            self.assertEqual(getdate(add_days(period.to_date, 1)), next_period.from_date)
+
+    def test_limit_tree_depth(self):
+        data = [
+            {"account": "Income", "indent": 0},
+            {"account": "Sales", "parent_account": "Income", "indent": 1},
+            {"account": "Domestic Sales", "parent_account": "Sales", "indent": 2},
+            {"account": "Other Income", "parent_account": "Income", "indent": 1},
+            {"account_name": "Total Income", "indent": None},
+        ]
+
+        out = limit_tree_depth(data, 2)
+        self.assertEqual([row.get("account") for row in out], ["Income", "Sales", "Other Income", None])
+        self.assertEqual(out[1].get("lazy_children"), 1)
+        self.assertFalse(out[2].get("lazy_children"))
+        # the input rows are left untouched
+        self.assertFalse(data[1].get("lazy_children"))
+
+        out = limit_tree_depth(data, 1)
+        self.assertEqual([row.get("account") for row in out], ["Income", None])
+        self.assertEqual(out[0].get("lazy_children"), 1)
+
+    def test_report_cache_key_per_language(self):
+        ctx = get_test_context(cache_key="filters-hash")
+        lang = frappe.local.lang
+        try:
+            frappe.local.lang = "en"
+            english_key = get_report_cache_key(ctx, "income")
+            frappe.local.lang = "ar"
+            arabic_key = get_report_cache_key(ctx, "income")
+        finally:
+            frappe.local.lang = lang
+
+        # cached rows hold translated labels that get_account_children matches on
+        self.assertNotEqual(english_key, arabic_key)
+
+    def test_minor_units(self):
+        ctx = get_test_context()
+        self.assertEqual(to_minor_units(0.1, ctx) + to_minor_units(0.2, ctx), 30)
+        self.assertEqual(to_minor_units(Decimal("1.005"), ctx), 101)
+        self.assertEqual(to_minor_units(-2.5, ctx), -250)
+        # floats round half up like the Decimal amounts they come from
+        self.assertEqual(to_minor_units(1.005, ctx), 101)
+        self.assertEqual(to_minor_units(0.125, ctx), 13)
+        self.assertEqual(to_minor_units(-0.125, ctx), -13)
+        self.assertEqual(to_minor_units(2.675, ctx), 268)
+        self.assertEqual(to_minor_units(None, ctx), 0)
+        self.assertEqual(to_minor_units(7, ctx), 700)
+        self.assertEqual(from_minor_units(30, ctx), 0.3)
+
+        rows = [{"indent": 0, "total": 0.1}, {"indent": 1, "total": 0.2}, {"indent": 0, "total": 0.2}]
+        self.assertEqual(sum_minor_units(rows, "total", ctx), 50)
+        self.assertEqual(sum_minor_units(rows, "total", ctx, root_only=True), 30)
+        self.assertEqual(sum_minor_units(None, "total", ctx), 0)
+
+    def test_minor_units_without_decimals(self):
+        ctx = get_test_context(precision=0)
+        self.assertEqual(ctx.scale, 1)
+        self.assertEqual(to_minor_units(1234.4, ctx), 1234)
+        self.assertEqual(from_minor_units(1234, ctx), 1234)
+
+    def test_gl_shards_follow_period_boundaries(self):
+        ctx = get_test_context()
+        shards = get_gl_shards(ctx, "2026-01-01", "2026-12-31", 4)
+
+        self.assertEqual(
+            shards,
+            [
+                (getdate("2026-01-01"), getdate("2026-03-31")),
+                (getdate("2026-04-01"), getdate("2026-06-30")),
+                (getdate("2026-07-01"), getdate("2026-09-30")),
+                (getdate("2026-10-01"), getdate("2026-12-31")),
+            ],
+        )
+
+    def test_gl_shards_cover_range_without_overlap(self):
+        ctx = get_test_context()
+        for shard_count in (1, 2, 5, 7, 12, 20):
+            shards = get_gl_shards(ctx, "2026-01-01", "2026-12-31", shard_count)
+
+            self.assertLessEqual(len(shards), min(shard_count, 12))
+            self.assertEqual(shards[0][0], getdate("2026-01-01"))
+            self.assertEqual(shards[-1][1], getdate("2026-12-31"))
+            for (_from_date, to_date), (next_from_date, _to_date) in zip(shards, shards[1:]):
+                self.assertEqual(getdate(add_days(to_date, 1)), next_from_date)
+
+    def test_gl_shards_within_one_period(self):
+        ctx = get_test_context()
+        self.assertEqual(
+            get_gl_shards(ctx, "2026-03-05", "2026-03-20", 4),
+            [(getdate("2026-03-05"), getdate("2026-03-20"))],
+        )
+
+    def test_clear_account_snapshot_on_rename(self):
+        doc = frappe._dict(company="_Test Company")
+
+        with patch.object(frappe.local.db, "after_commit") as after_commit:
+            # after_rename handlers also get the old and new name and the merge flag
+            clear_account_snapshot(doc, "after_rename", "Sales - _TC", "Domestic Sales - _TC", False)
+
+        after_commit.add.assert_called_once()
+        with patch("frappe.cache") as cache:
+            after_commit.add.call_args[0][0]()
+
+        cache.return_value.delete_value.assert_called_once_with(get_account_snapshot_cache_key("_Test Company"))
+
+    def test_gl_delta_negates_cancelled_rows(self):
+        ctx = get_test_context()
+
+        def get_entries(*args, **kwargs):
+            self.assertEqual(kwargs["changed_since"], "2026-03-01 10:00:00")
+            self.assertEqual(kwargs["as_of"], "2026-03-01 10:05:00")
+            if kwargs.get("cancelled"):
+                return [get_delta_entry(credit=100)]
+            return [get_delta_entry(credit=40)]
+
+        with patch("worldrep_report.utils.get_accounting_entries", side_effect=get_entries):
+            entries = get_gl_delta_entries(
+                ctx, "2026-01-01", "2026-12-31", ["Sales"], False, "2026-03-01 10:00:00", "2026-03-01 10:05:00"
+            )
+
+        self.assertEqual(sum(entry.credit for entry in entries), -60)
+        self.assertEqual(sum(entry.credit_in_account_currency for entry in entries), -60)
+
+        with patch("worldrep_report.utils.get_accounting_entries") as get_entries:
+            self.assertEqual(get_gl_delta_entries(ctx, "2026-01-01", "2026-12-31", [], False, "a", "b"), [])
+            get_entries.assert_not_called()
+
+    def test_gl_watermark_filters(self):
+        ctx = get_test_context()
+
+        def get_sql(**kwargs):
+            with patch.object(frappe.local.db, "sql", return_value=[]) as sql:
+                get_accounting_entries(
+                    "GL Entry", "2026-01-01", "2026-12-31", ["Sales"], ctx, False, group_by_posting_date=True, **kwargs
+                )
+            return str(sql.call_args[0][0])
+
+        query = get_sql()
+        self.assertNotIn("`creation`", query)
+        self.assertNotIn("`modified`", query)
+
+        # rows posted by the mark and not cancelled by then
+        query = get_sql(as_of="2026-03-01 10:05:00")
+        self.assertIn("`creation`<=", query)
+        self.assertIn("`modified`>", query)
+
+        # rows posted since the previous mark
+        query = get_sql(as_of="2026-03-01 10:05:00", changed_since="2026-03-01 10:00:00")
+        self.assertIn("`creation`>", query)
+        self.assertIn("`creation`<=", query)
+
+        # rows posted before the previous mark and cancelled in between
+        query = get_sql(as_of="2026-03-01 10:05:00", changed_since="2026-03-01 10:00:00", cancelled=True)
+        self.assertNotIn("`creation`>", query)
+        self.assertIn("`creation`<=", query)
+        self.assertIn("`modified`>", query)
+        self.assertIn("`modified`<=", query)
+
+    def test_gl_delta_limits(self):
+        ctx = get_test_context()
+        cached = {"watermark": "2026-03-01 10:00:00", "scanned_at": now_datetime(), "deltas": 0, "entries": {}}
+
+        with patch("worldrep_report.utils.has_ledger_rebuild_since", return_value=False):
+            self.assertTrue(can_apply_gl_delta(ctx, cached, "2026-01-01"))
+            self.assertFalse(can_apply_gl_delta(ctx, None, "2026-01-01"))
+            # opening balances come from closing snapshots, which the delta does not cover
+            self.assertFalse(can_apply_gl_delta(ctx, cached, None))
+            self.assertFalse(can_apply_gl_delta(ctx, dict(cached, deltas=GL_DELTA_MAX_COUNT), "2026-01-01"))
+            self.assertFalse(
+                can_apply_gl_delta(
+                    ctx,
+                    dict(cached, scanned_at=add_to_date(now_datetime(), seconds=-GL_DELTA_MAX_AGE - 1)),
+                    "2026-01-01",
+                )
+            )
+
+        with patch("worldrep_report.utils.has_ledger_rebuild_since", return_value=True):
+            self.assertFalse(can_apply_gl_delta(ctx, cached, "2026-01-01"))
+
+    def test_opening_entries_from_closing_snapshot(self):
+        ctx = get_test_context()
+        period_closing_voucher = frappe._dict(name="PCV-0001", period_end_date=getdate("2025-12-31"))
+
+        def get_entries(doctype, *args, **kwargs):
+            return [frappe._dict(account="Sales", debit=0, credit=100 if doctype == "GL Entry" else 1000)]
+
+        with patch(
+            "worldrep_report.utils.get_last_period_closing_voucher", return_value=period_closing_voucher
+        ), patch("worldrep_report.utils.get_accounting_entries", side_effect=get_entries) as get_accounting_entries:
+            entries = get_opening_entries(ctx, "2026-03-01", ["Sales"], False, ignore_opening_entries=True)
+
+        self.assertEqual(len(get_accounting_entries.call_args_list), 2)
+        snapshot_call, delta_call = get_accounting_entries.call_args_list
+
+        self.assertEqual(snapshot_call.args[0], "Account Closing Balance")
+        self.assertEqual(snapshot_call.kwargs["period_closing_voucher"], "PCV-0001")
+
+        # the GL delta starts the day after the closing and keeps the caller's flag
+        self.assertEqual(delta_call.args[0], "GL Entry")
+        self.assertEqual(getdate(delta_call.args[1]), getdate("2026-01-01"))
+        self.assertEqual(getdate(delta_call.args[2]), getdate("2026-02-28"))
+        self.assertTrue(delta_call.kwargs["ignore_opening_entries"])
+
+        self.assertEqual(sorted(entry.credit for entry in entries), [100, 1000])
+        for entry in entries:
+            self.assertEqual(entry.posting_date, getdate("2026-02-28"))
+            self.assertIsNone(entry.fiscal_year)
+
+    def test_opening_entries_without_closing(self):
+        ctx = get_test_context()
+
+        with patch("worldrep_report.utils.get_last_period_closing_voucher", return_value=None), patch(
+            "worldrep_report.utils.get_accounting_entries",
+            return_value=[frappe._dict(account="Sales", debit=0, credit=100)],
+        ) as get_accounting_entries:
+            entries = get_opening_entries(ctx, "2026-03-01", ["Sales"], False)
+
+        get_accounting_entries.assert_called_once()
+        call = get_accounting_entries.call_args
+        self.assertEqual(call.args[0], "GL Entry")
+        self.assertIsNone(call.args[1])
+        self.assertEqual(getdate(call.args[2]), getdate("2026-02-28"))
+        self.assertFalse(call.kwargs["ignore_opening_entries"])
+        self.assertEqual(entries[0].posting_date, getdate("2026-02-28"))
+
+    def test_progressive_run_is_enqueued(self):
+        ctx = get_test_context()
+        filters = {"company": "_Test Company", "progressive_loading": 1}
+
+        with patch.object(p_and_l.frappe, "enqueue") as enqueue, patch.object(
+            p_and_l, "get_report_columns", return_value=[]
+        ):
+            columns, data, *_ = p_and_l.start_progressive_run(ctx, filters)
+
+        enqueue.assert_called_once()
+        self.assertIs(enqueue.call_args.args[0], p_and_l.run_progressive_report)
+        self.assertFalse(enqueue.call_args.kwargs.get("enqueue_after_commit"))
+        self.assertEqual(enqueue.call_args.kwargs["filters"], filters)
+
+        # the placeholder names the task, so the client can ignore events of other runs
+        self.assertEqual(data[0]["p_and_l_task_id"], enqueue.call_args.kwargs["task_id"])
+
+    def test_batch_requires_company_access(self):
+        filters_list = [{"company": "_Test Company"}, {"company": "_Test Company 1"}]
+
+        with patch("frappe.has_permission", side_effect=lambda doctype, doc=None, **kwargs: doc == "_Test Company"):
+            with patch.object(p_and_l, "get_report_context") as get_report_context:
+                self.assertRaises(frappe.PermissionError, p_and_l.execute_batch, frappe.as_json(filters_list))
+
+        # nothing is computed for a batch with a company the caller cannot see
+        get_report_context.assert_not_called()
+
+    def test_month_end_pack_limited_to_permitted_companies(self):
+        pack = {
+            "generated_on": "2026-10-01 01:00:00",
+            "results": [{"filters": {"company": "_Test Company"}}, {"filters": {"company": "_Test Company 1"}}],
+        }
+
+        with patch("frappe.cache") as cache, patch("frappe.get_cached_doc"), patch(
+            "frappe.has_permission", side_effect=lambda doctype, doc=None, **kwargs: doc == "_Test Company"
+        ):
+            cache.return_value.get_value.return_value = pack
+            result = get_month_end_pack()
+
+        self.assertEqual(result["generated_on"], pack["generated_on"])
+        self.assertEqual([r["filters"]["company"] for r in result["results"]], ["_Test Company"])
+
+    def test_total_row_matches_root_rows(self):
+        period_list = get_monthly_periods(months=2)
+        with patch("worldrep_report.utils.get_fiscal_year", return_value=("2025",)):
+            comparative_period_list = get_comparative_period_list(period_list, "Previous Year", "_Test Company")
+
+        ctx = get_test_context(
+            period_list=period_list,
+            comparative_period_list=comparative_period_list,
+            currency="INR",
+            year_start_date="2026-01-01",
+            year_end_date="2026-12-31",
+        )
+
+        def get_account(name, parent_account=None, indent=0, is_group=0, **values):
+            return frappe._dict(
+                name=name, account_name=name, parent_account=parent_account, indent=indent, is_group=is_group, **values
+            )
+
+        keys = [period.key for period in period_list + comparative_period_list]
+        accounts = [
+            get_account("Income", is_group=1),
+            get_account("Sales", "Income", 1),
+            get_account("Domestic Sales", "Sales", 2, **{keys[0]: -10001, keys[1]: -2050, keys[2]: -7, keys[3]: -333}),
+            get_account("Other Income", "Income", 1, **{keys[0]: -1, keys[1]: 5, keys[3]: -20000}),
+            get_account("Indirect Income"),
+            get_account("Interest", "Indirect Income", 1, **{keys[0]: -99, keys[2]: -1234, "opening_balance": -500}),
+        ]
+        accounts_by_name = {account.name: account for account in accounts}
+
+        accumulate_values_into_parents(accounts, accounts_by_name, ctx)
+        with patch("worldrep_report.utils.get_account_labels", return_value={}):
+            out = prepare_data(accounts, "Credit", ctx)
+        add_total_row(out, "Income", "Credit", ctx, [account for account in accounts if not account.parent_account])
+
+        root_rows = [row for row in out if row.get("indent") == 0]
+        total_row = out[-2]
+        self.assertEqual(out[-1], {})
+
+        for key in keys + ["total", "opening_balance"]:
+            self.assertEqual(
+                to_minor_units(total_row[key], ctx), sum(to_minor_units(row[key], ctx) for row in root_rows), key
+            )
+        for period in comparative_period_list:
+            self.assertEqual(
+                to_minor_units(total_row[period.variance_key], ctx),
+                sum(to_minor_units(row[period.variance_key], ctx) for row in root_rows),
+            )
+
+        self.assertEqual(total_row[keys[0]], 101.01)
+        self.assertEqual(total_row["total"], 121.46)
+
+    def run_on_report_replica(self, **lag):
+        """Run a `use_report_replica` block on a mocked replica; return the connections involved."""
+        primary = frappe.local.db
+
+        with patch.dict(frappe.local.conf, {"p_and_l_read_from_replica": 1, "replica_host": "replica"}), patch(
+            "frappe.connect_replica", side_effect=connect_mock_replica
+        ), patch("worldrep_report.utils.get_replica_lag", **lag):
+            with use_report_replica():
+                used, replica = frappe.local.db, frappe.local.replica_db
+
+        # the primary connection is restored and the replica closed after the block
+        self.assertIs(frappe.local.db, primary)
+        self.assertFalse(hasattr(frappe.local, "primary_db"))
+        self.assertFalse(hasattr(frappe.local, "replica_db"))
+        replica.close.assert_called_once()
+
+        return used, primary, replica
+
+    def test_report_replica_within_lag(self):
+        used, primary, replica = self.run_on_report_replica(return_value=5)
+        self.assertIs(used, replica)
+
+    def test_report_replica_falls_back_to_primary(self):
+        for lag in (dict(return_value=600), dict(return_value=None), dict(side_effect=Exception("unreachable"))):
+            used, primary, replica = self.run_on_report_replica(**lag)
+            self.assertIs(used, primary, lag)
+
+    def test_report_replica_restores_connection_on_error(self):
+        primary = frappe.local.db
+
+        with patch.dict(frappe.local.conf, {"p_and_l_read_from_replica": 1, "replica_host": "replica"}), patch(
+            "frappe.connect_replica", side_effect=connect_mock_replica
+        ), patch("worldrep_report.utils.get_replica_lag", return_value=0):
+            with self.assertRaises(ZeroDivisionError), use_report_replica():
+                1 / 0
+
+        self.assertIs(frappe.local.db, primary)
+
+    def test_gl_settled_mark(self):
+        ctx = get_test_context(shared=frappe._dict(gl_watermark="2020-01-01 10:00:00.000001"))
+        # a quiet ledger is read up to its latest change
+        self.assertEqual(get_gl_settled_mark(ctx), "2020-01-01 10:00:00.000001")
+
+        ctx.shared.gl_watermark = str(now_datetime())
+        mark = get_gl_settled_mark(ctx)
+        self.assertLess(mark, ctx.shared.gl_watermark)
+        self.assertGreaterEqual(mark, str(add_to_date(now_datetime(), seconds=-GL_COMMIT_WINDOW - 5)))
+
+        ctx.shared.gl_watermark = ""
+        self.assertEqual(get_gl_settled_mark(ctx), "")
+
+    def test_gl_scan_cached_up_to_settled_mark(self):
+        watermark = str(now_datetime())
+        ctx = get_test_context(shared=frappe._dict(gl_entries={}, gl_watermark=watermark), gl_key="[]")
+        scan = {"Sales": [get_delta_entry(credit=100)]}
+
+        with patch("frappe.cache") as cache, patch(
+            "worldrep_report.utils.get_account_snapshot",
+            return_value=[frappe._dict(name="Sales", is_group=0, report_type="Profit and Loss")],
+        ), patch("worldrep_report.utils.set_gl_entries_by_account", return_value=scan) as set_gl_entries, patch(
+            "worldrep_report.utils.get_gl_delta_entries", return_value=[get_delta_entry(credit=5)]
+        ) as get_delta_entries:
+            cache.return_value.get_value.return_value = None
+            gl_entries_by_account = get_gl_entries_by_account(ctx, "2026-01-01", "2026-12-31", "Profit and Loss")
+
+        mark = set_gl_entries.call_args.kwargs["as_of"]
+        self.assertLess(mark, watermark)
+
+        # the scan is cached at the settled mark, without the rows changed since
+        cached = cache.return_value.set_value.call_args.args[1]
+        self.assertEqual(cached["watermark"], mark)
+        self.assertEqual(len(cached["entries"]["Sales"]), 1)
+
+        # which are added for this run only
+        self.assertEqual(get_delta_entries.call_args.args[-2:], (mark, watermark))
+        self.assertEqual([entry.credit for entry in gl_entries_by_account["Sales"]], [100, 5])
+
+    def test_gl_delta_converted_with_the_scan(self):
+        watermark = str(now_datetime())
+        ctx = get_test_context(
+            shared=frappe._dict(gl_entries={}, gl_watermark=watermark),
+            gl_key="[]",
+            currency_info={"presentation_currency": "USD", "company_currency": "INR", "report_date": "2026-12-31"},
+        )
+        scan = {
+            "Sales": [frappe._dict(get_delta_entry(credit=8300), account_currency="INR")],
+            "Sales USD": [frappe._dict(get_delta_entry(credit=8300), account="Sales USD", account_currency="USD")],
+        }
+        delta = [frappe._dict(get_delta_entry(credit=830), account="Sales USD", account_currency="USD")]
+
+        with patch("frappe.cache") as cache, patch(
+            "worldrep_report.utils.get_account_snapshot",
+            return_value=[
+                frappe._dict(name=name, is_group=0, report_type="Profit and Loss") for name in ("Sales", "Sales USD")
+            ],
+        ), patch("worldrep_report.utils.set_gl_entries_by_account", return_value=scan) as set_gl_entries, patch(
+            "worldrep_report.utils.get_gl_delta_entries", return_value=delta
+        ), patch("worldrep_report.utils.convert_to_presentation_currency") as convert:
+            cache.return_value.get_value.return_value = None
+            gl_entries_by_account = get_gl_entries_by_account(ctx, "2026-01-01", "2026-12-31", "Profit and Loss")
+
+        # the delta is converted in the same batch as the scan, which is cached unconverted
+        self.assertFalse(set_gl_entries.call_args.kwargs["convert_currency"])
+        convert.assert_called_once()
+        self.assertEqual(
+            sorted((entry.account, entry.credit) for entry in convert.call_args.args[0]),
+            [("Sales", 8300), ("Sales USD", 830), ("Sales USD", 8300)],
+        )
+        self.assertEqual(len(gl_entries_by_account["Sales USD"]), 2)
+        self.assertIsNot(gl_entries_by_account["Sales"][0], scan["Sales"][0])